@@ -0,0 +1,245 @@
+import time
+import zlib
+from random import Random
+
+from recommendations import sim_tanimoto, sim_tanimoto_sets, top_matches
+
+"""
+Approximate nearest neighbour indexes for top_matches and get_recommendations
+Locality sensitive hashing puts similar persons in the same buckets, so a query only scores the persons
+that share a bucket with it instead of everybody in preferences. Candidates are then scored exactly
+- MinHashIndex hashes the set of rated items, a collision is likely when the Tanimoto score is high
+- HyperplaneIndex hashes the sign of random projections of the ratings, a collision is likely when the cosine
+  of the full rating vectors is high, unrated items counting as 0. With centre=True ratings are taken relative
+  to each person's mean
+
+sim_cosine and sim_pearson only score co-rated items, a different similarity: a person sharing a single item
+with the query gets a cosine of 1.0 whatever the rest of the ratings are. Neither index finds such matches better
+than a random sample of the same size, so build_index only offers MinHashIndex for the Tanimoto scores.
+
+Recall on synthetic_data.power_law_preferences(1500, 300, density=0.05), top 5 matches of 300 persons, against
+a random sample of as many persons as the index returned:
+    sim_tanimoto    MinHashIndex(bands=32, rows=2)                  0.95 recall, random 0.32, 26% of persons scored
+    sim_cosine      HyperplaneIndex(tables=16, bits=8)              0.94 recall, random 0.96, 15% scored
+    sim_cosine      MinHashIndex(bands=32, rows=2)                  0.80 recall, random 0.99, 26% scored
+    sim_pearson     HyperplaneIndex(tables=16, bits=8, centre=True) 0.58 recall, random 0.59, 12% scored
+    sim_pearson     MinHashIndex(bands=32, rows=2)                  0.69 recall, random 0.68, 26% scored
+Measure other data with recall_report before trusting the knobs
+"""
+
+# Mersenne prime 2^61 - 1 for the universal hash functions
+PRIME = (1 << 61) - 1
+
+
+def _item_hash(item):
+    if not isinstance(item, str):
+        item = unicode(item).encode('utf-8')
+    return zlib.crc32(item) & 0xffffffff
+
+
+class LSHIndex(object):
+    def __init__(self, preferences, seed=0):
+        """
+        Hash every person of preferences into one bucket per table
+        :param preferences: the dictionary of preferences. The key is the name of persons
+        :param seed: seed of the random hash functions
+        """
+        self.random = Random(seed)
+        self.setup()
+        self.tables = [{} for i in range(self.table_count)]
+        self.keys = {}
+        for person, ratings in preferences.items():
+            self.add(person, ratings)
+
+    def setup(self):
+        raise NotImplementedError
+
+    def hash_keys(self, ratings):
+        """
+        :param ratings: dictionary of item -> rating of one person
+        :return: list of bucket keys, one per table
+        """
+        raise NotImplementedError
+
+    def add(self, person, ratings):
+        """
+        Index a new person, or index again a person whose ratings changed
+        :return: None
+        """
+        self.remove(person)
+        keys = self.hash_keys(ratings)
+        self.keys[person] = keys
+        for table, key in zip(self.tables, keys):
+            table.setdefault(key, []).append(person)
+
+    def remove(self, person):
+        keys = self.keys.pop(person, None)
+        if keys is None:
+            return
+        for table, key in zip(self.tables, keys):
+            table[key].remove(person)
+            if not table[key]:
+                del table[key]
+
+    def __contains__(self, person):
+        return person in self.keys
+
+    def candidates(self, person, ratings=None):
+        """
+        Persons that share at least one bucket with person
+        :param person: name of a person
+        :param ratings: ratings to query with, needed when person is not in the index
+        :return: set of names, person excluded
+        """
+        if ratings is None and person not in self.keys:
+            raise KeyError('{} is not in the index, give the ratings to query with'.format(person))
+        keys = self.keys.get(person) if ratings is None else self.hash_keys(ratings)
+        result = set()
+        for table, key in zip(self.tables, keys):
+            result.update(table.get(key, ()))
+        result.discard(person)
+        return result
+
+
+class MinHashIndex(LSHIndex):
+    def __init__(self, preferences, bands=32, rows=2, seed=0):
+        """
+        MinHash banding for sim_tanimoto
+        Two persons share a bucket in a band with probability tanimoto^rows.
+        More bands raise recall, more rows per band cut the number of candidates and the query latency
+        :param bands: number of tables
+        :param rows: min hashes per band
+        """
+        self.bands = bands
+        self.rows = rows
+        LSHIndex.__init__(self, preferences, seed)
+
+    def setup(self):
+        self.table_count = self.bands
+        self.hash_functions = [(self.random.randint(1, PRIME - 1), self.random.randint(0, PRIME - 1))
+                               for i in range(self.bands * self.rows)]
+
+    def hash_keys(self, ratings):
+        items = [_item_hash(item) for item in ratings]
+        if not items:
+            return [None] * self.bands
+        signature = [min((a * x + b) % PRIME for x in items) for a, b in self.hash_functions]
+        return [tuple(signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+
+class HyperplaneIndex(LSHIndex):
+    def __init__(self, preferences, tables=16, bits=8, centre=False, seed=0):
+        """
+        Random hyperplane (sign random projection) hashing for the cosine of full rating vectors, see above
+        Every bit agrees with probability 1 - angle / pi between the two rating vectors.
+        More tables raise recall, more bits per table cut the number of candidates and the query latency
+        :param tables: number of tables
+        :param bits: hyperplanes per table
+        :param centre: subtract each person's mean rating before projecting
+        """
+        self.table_count = tables
+        self.bits = bits
+        self.centre = centre
+        LSHIndex.__init__(self, preferences, seed)
+
+    def setup(self):
+        # every hyperplane has a +1/-1 component per item, derived from a hash of the item
+        # so the planes cover items that were never seen at build time
+        self.planes = [(self.random.randint(1, PRIME - 1), self.random.randint(0, PRIME - 1))
+                       for i in range(self.table_count * self.bits)]
+
+    def hash_keys(self, ratings):
+        mean = float(sum(ratings.values())) / len(ratings) if self.centre and ratings else 0.0
+        items = [(_item_hash(item), rating - mean) for item, rating in ratings.items()]
+        key = 0
+        keys = []
+        for k, (a, b) in enumerate(self.planes):
+            projection = 0.0
+            for x, rating in items:
+                if ((a * x + b) % PRIME) >> 60:
+                    projection += rating
+                else:
+                    projection -= rating
+            key = (key << 1) | (projection > 0)
+            if (k + 1) % self.bits == 0:
+                keys.append(key)
+                key = 0
+        return keys
+
+
+def build_index(preferences, similarity=sim_tanimoto, **knobs):
+    """
+    Build the index that matches a similarity function
+    :param preferences: the dictionary of preferences. The key is the name of persons
+    :param similarity: sim_tanimoto or sim_tanimoto_sets. The co-rated scores sim_cosine and sim_pearson have no
+        index that beats a random sample, see above
+    :param knobs: keyword arguments of MinHashIndex
+    :return: LSHIndex
+    """
+    if similarity in (sim_tanimoto, sim_tanimoto_sets):
+        return MinHashIndex(preferences, **knobs)
+    raise ValueError('No index for similarity {}'.format(similarity.__name__))
+
+
+def _found(exact, approximate):
+    # candidates are scored exactly, a match is found when it scores as high as the exact n-th match.
+    # Co-rated similarities give many ties at 1.0 and any of the tied persons is as good an answer
+    expected = [score for score, name in exact if score > 0]
+    if not expected:
+        return 0, 0
+    return min(len(expected), sum(1 for score, name in approximate if score >= expected[-1])), len(expected)
+
+
+def recall_report(preferences, index, n=5, similarity=sim_tanimoto, people=None, seed=0):
+    """
+    Measure the index against the exact brute force top_matches and against a random sample of persons
+    Recall is the share of the exact top n matches with a positive score that the index also returns, a person
+    tied with the n-th exact match counts as found. The baseline scores, for every query, as many persons drawn
+    at random as the index returned candidates: an index is only worth its upkeep when it beats that
+    :param preferences: the dictionary of preferences. The key is the name of persons
+    :param index: LSHIndex built from preferences
+    :param n: how many matches per query
+    :param similarity: similarity function
+    :param people: persons to query, default is everybody
+    :param seed: seed of the random baseline
+    :return: dictionary with recall, recall of the random baseline, mean share of persons scored per query and
+        total seconds of both methods
+    """
+    if people is None:
+        people = list(preferences)
+    rng = Random(seed)
+    names = list(preferences)
+    found = 0
+    baseline_found = 0
+    relevant = 0
+    candidates = 0
+    exact_seconds = 0.0
+    approximate_seconds = 0.0
+    for person in people:
+        start = time.time()
+        exact = top_matches(preferences, person, n, similarity)
+        exact_seconds += time.time() - start
+
+        start = time.time()
+        approximate = top_matches(preferences, person, n, similarity, index=index)
+        approximate_seconds += time.time() - start
+
+        sample_size = len(index.candidates(person))
+        sample = [name for name in rng.sample(names, min(sample_size + 1, len(names))) if name != person]
+        baseline = sorted([(similarity(preferences, name, person), name) for name in sample[:sample_size]],
+                          reverse=True)[:n]
+
+        hits, expected = _found(exact, approximate)
+        found += hits
+        relevant += expected
+        baseline_found += _found(exact, baseline)[0]
+        candidates += sample_size
+
+    return {
+        'people': len(people),
+        'recall': float(found) / relevant if relevant else 1.0,
+        'random_recall': float(baseline_found) / relevant if relevant else 1.0,
+        'candidate_fraction': float(candidates) / (len(people) * max(len(preferences) - 1, 1)) if people else 0.0,
+        'exact_seconds': exact_seconds,
+        'approximate_seconds': approximate_seconds
+    }
@@ -0,0 +1,97 @@
+from array import array
+
+from rating_matrix import co_rating_statistics, pearson_score
+from ranking import top_k
+from similarity_engine import score_tile
+
+"""
+Bulk user based recommendations over a RatingMatrix
+Users are walked in row order. Each user is scored once against every later row, the tile of one row of
+similarity_engine, and every positive similarity (u, v) goes to the similarity rows of both users, so every pair
+is scored once. The similarity row of a user is then complete, since every earlier user already pushed its pair
+with it. totals and sim_sums of get_recommendations are the sparse products S.R and S.B of that similarity row
+with the rating matrix R and its pattern B, accumulated over the CSR arrays, and the user is yielded and
+forgotten.
+Memory holds the positive similarities between the users done and the users still to come, never the rankings
+"""
+
+
+def _recommend(matrix, u, neighbours, weights, n):
+    """
+    :param neighbours: array of row indices with a positive similarity to u, in increasing order
+    :param weights: array of their similarities
+    :return: [(score, item), ...] from highest to lowest
+    """
+    indptr, indices, values = matrix.indptr, matrix.indices, matrix.values
+    # items u already rated are not recommended, a rating of 0 counts as not rated
+    seen = set(indices[k] for k in range(indptr[u], indptr[u + 1]) if values[k] != 0)
+    totals = {}
+    sim_sums = {}
+    for v, sim in zip(neighbours, weights):
+        for k in range(indptr[v], indptr[v + 1]):
+            j = indices[k]
+            if j in seen:
+                continue
+            totals[j] = totals.get(j, 0) + values[k] * sim
+            sim_sums[j] = sim_sums.get(j, 0) + sim
+    column_ids = matrix.column_ids
+    return top_k(((total / sim_sums[j], column_ids[j]) for j, total in totals.items()), n)
+
+
+def _iter_one_by_one(matrix, rows, score, n):
+    # a few users: one walk per user over the ratings it shares with others is cheaper than half of all pairs
+    lengths = matrix.row_lengths
+    for u in rows:
+        positive = sorted((v, sim) for v, sim in
+                          ((v, score(statistics, lengths[u], lengths[v]))
+                           for v, statistics in co_rating_statistics(matrix, u).items()) if sim > 0)
+        yield matrix.row_ids[u], _recommend(matrix, u, array('i', [v for v, sim in positive]),
+                                            array('d', [sim for v, sim in positive]), n)
+
+
+def iter_batch_recommendations(matrix, rows=None, score=pearson_score, n=None):
+    """
+    Rank unseen items for many users in one pass
+    Results are yielded one user at a time, so a run over millions of users never holds all rankings at once
+    :param matrix: RatingMatrix with users as rows
+    :param rows: iterable of row indices, default is every user. When fewer than a quarter of the users are
+        asked for, each one is scored on its own instead
+    :param score: score kernel from rating_matrix, symmetric in its 2 rows like all of them
+    :param n: how many items per user, None returns all of them
+    :return: generator of (user name, [(score, item), ...] from highest to lowest), in increasing row order when
+        every pair is scored once, in the order of rows otherwise
+    """
+    total = len(matrix.row_ids)
+    if rows is not None:
+        rows = list(rows)
+        if len(rows) * 4 < total:
+            for result in _iter_one_by_one(matrix, rows, score, n):
+                yield result
+            return
+        wanted = set(rows)
+        last = max(rows) if rows else -1
+    else:
+        wanted = None
+        last = total - 1
+
+    # row index -> (neighbour indices, similarities) found so far, for the users not yielded yet
+    found = {}
+    for u in range(last + 1):
+        # pairs with the earlier rows were pushed when those rows came
+        for s, i, v in score_tile(matrix, (u, u + 1, u + 1, total), score):
+            if s <= 0:
+                continue
+            if wanted is None or v in wanted:
+                if v not in found:
+                    found[v] = (array('i'), array('d'))
+                found[v][0].append(u)
+                found[v][1].append(s)
+            if wanted is None or u in wanted:
+                if u not in found:
+                    found[u] = (array('i'), array('d'))
+                found[u][0].append(v)
+                found[u][1].append(s)
+        if wanted is not None and u not in wanted:
+            continue
+        neighbours, weights = found.pop(u, (array('i'), array('d')))
+        yield matrix.row_ids[u], _recommend(matrix, u, neighbours, weights, n)
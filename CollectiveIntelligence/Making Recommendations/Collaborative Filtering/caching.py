@@ -0,0 +1,238 @@
+import inspect
+import time
+from collections import OrderedDict
+
+"""
+Caching layer for the similarity and ranking functions of recommendations.py
+Entries are tagged with the users and items they depend on, so when a rating changes only the entries of
+that user and that item are dropped.
+
+    cache = LRUCache(maxsize=100000, ttl=600)
+    similarity = cached_similarity(sim_pearson, cache)
+    recommend = cached_ranking(get_recommendations, cache)
+    recommend(critics, 'Toby', similarity)
+    ...
+    critics['Toby']['Just My Luck'] = 2.0
+    on_rating_changed(cache, 'Toby', 'Just My Luck', critics)
+
+Similarities only read co-rated items, so the tags of the person and of every item it rated already catch each
+rating that changes one of its similarities. A user based ranking also reads the ratings of the neighbours the
+similarity scored above 0, get_recommendations averages them, so those neighbours are tagged as well.
+A brand new person enters top_matches with a score of 0: pass preferences to on_rating_changed to drop those
+rankings too
+"""
+
+_missing = object()
+
+# tag of the user based rankings that a person who had no ratings yet can enter
+NEW_PERSON = ('new person',)
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=10000, ttl=None, clock=time.time):
+        """
+        :param maxsize: maximum number of entries, the least recently used entry is evicted first
+        :param ttl: optional number of seconds an entry stays valid
+        :param clock: function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (value, expiry time, tags), oldest first
+        self.entries = OrderedDict()
+        # tag -> set of keys
+        self.tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.pop(key, _missing)
+        if entry is _missing:
+            self.misses += 1
+            return default
+        if entry[1] is not None and entry[1] <= self.clock():
+            self._forget(key, entry)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        # move to the most recently used end
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, tags=()):
+        old = self.entries.pop(key, _missing)
+        if old is not _missing:
+            self._forget(key, old)
+        expiry = self.clock() + self.ttl if self.ttl is not None else None
+        tags = frozenset(tags)
+        self.entries[key] = (value, expiry, tags)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            oldest, entry = self.entries.popitem(last=False)
+            self._forget(oldest, entry)
+            self.evictions += 1
+
+    def _forget(self, key, entry):
+        # remove key from the tag index, the entry itself is already out of entries
+        for tag in entry[2]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate(self, tag):
+        """
+        Drop every entry tagged with tag
+        :param tag: user or item name
+        :return: number of entries dropped
+        """
+        keys = self.tags.pop(tag, ())
+        for key in keys:
+            entry = self.entries.pop(key, _missing)
+            if entry is not _missing:
+                self._forget(key, entry)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self.entries.clear()
+        self.tags.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        Counters to size the cache with
+        :return: dictionary of counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations
+        }
+
+
+def _key_part(argument):
+    # dictionaries and indexes are keyed by identity, a cache serves one long lived preferences dictionary
+    try:
+        hash(argument)
+        return argument
+    except TypeError:
+        return id(argument)
+
+
+def _names(arguments):
+    return [argument for argument in arguments if isinstance(argument, basestring)]
+
+
+def cached_similarity(similarity, cache):
+    """
+    Wrap a similarity function so scores are served from cache
+    :param similarity: e.g. sim_pearson
+    :param cache: LRUCache
+    :return: function with the same arguments as similarity
+    """
+    def wrapper(preferences, person1, person2):
+        key = (similarity, id(preferences), person1, person2)
+        value = cache.get(key, _missing)
+        if value is _missing:
+            value = similarity(preferences, person1, person2)
+            cache.put(key, value, tags=(person1, person2))
+        return value
+    wrapper.__name__ = similarity.__name__
+    wrapper.__doc__ = similarity.__doc__
+    return wrapper
+
+
+def _similarity_position(ranking):
+    """
+    :return: (index of the similarity argument of ranking, its default), (None, None) without one
+    """
+    spec = inspect.getargspec(ranking)
+    if 'similarity' not in spec.args:
+        return None, None
+    position = spec.args.index('similarity')
+    first_default = len(spec.args) - len(spec.defaults or ())
+    return position, spec.defaults[position - first_default] if position >= first_default else None
+
+
+def cached_ranking(ranking, cache, user_based=True):
+    """
+    Wrap top_matches, get_recommendations or get_recommended_items so rankings are served from cache
+    Entries are tagged with the person they were computed for, the items that person rated and every ranked item
+    or person. When user_based, the similarity is watched during the call and every person it scores above 0 is
+    tagged too
+    :param ranking: ranking function, its first argument is the dictionary of preferences
+    :param cache: LRUCache
+    :param user_based: True for top_matches and get_recommendations. get_recommended_items reads the other
+        persons through item_match only and can pass False
+    :return: function with the same arguments as ranking
+    """
+    position, default_similarity = _similarity_position(ranking) if user_based else (None, None)
+
+    def wrapper(*args, **kwargs):
+        if kwargs.get('lazy'):
+            # an iterator is consumed once, there is nothing to serve again
+            return ranking(*args, **kwargs)
+        key = (ranking, tuple(_key_part(argument) for argument in args),
+               tuple(sorted((name, _key_part(argument)) for name, argument in kwargs.items())))
+        value = cache.get(key, _missing)
+        if value is _missing:
+            neighbours = set()
+            if position is not None:
+                if len(args) > position:
+                    similarity = args[position]
+                else:
+                    similarity = kwargs.get('similarity', default_similarity)
+
+                def watched(preferences, person1, person2):
+                    score = similarity(preferences, person1, person2)
+                    if score > 0:
+                        neighbours.add(person1)
+                        neighbours.add(person2)
+                    return score
+                if len(args) > position:
+                    args = args[:position] + (watched,) + args[position + 1:]
+                else:
+                    kwargs = dict(kwargs, similarity=watched)
+            value = ranking(*args, **kwargs)
+
+            names = _names(args) + _names(kwargs.values())
+            preferences = args[0] if args else kwargs.get('preferences')
+            tags = set(names)
+            for person in names:
+                tags.update(preferences.get(person, ()))
+            tags.update(name for score, name in value)
+            if user_based:
+                tags.update(neighbours)
+                tags.add(NEW_PERSON)
+            cache.put(key, value, tags=tags)
+        return value
+    wrapper.__name__ = ranking.__name__
+    wrapper.__doc__ = ranking.__doc__
+    return wrapper
+
+
+def on_rating_changed(cache, user, item, preferences=None):
+    """
+    Drop the entries that depend on the rating of user for item
+    :param preferences: optional dictionary of preferences after the change, to find out whether user is new
+    :return: number of entries dropped
+    """
+    dropped = cache.invalidate(user) + cache.invalidate(item)
+    if preferences is not None and len(preferences.get(user, ())) <= 1:
+        dropped += cache.invalidate(NEW_PERSON)
+    return dropped
@@ -0,0 +1,171 @@
+from rating_matrix import pearson_score, tanimoto_score
+from similarity_engine import push_bounded
+
+"""
+Incremental item similarity maintenance
+For every pair of items rated by a common user we keep the sufficient statistics of their co-ratings
+(count, sums, sums of squares, sum of products and sum of squared differences), the same terms
+sim_pearson and sim_distance add up. A new, changed or deleted rating only touches the pairs of the
+items that user rated, so only their neighbour lists need to be computed again
+"""
+
+
+class IncrementalItemSimilarity(object):
+    def __init__(self, preferences=None, n=10, score=pearson_score):
+        """
+        :param preferences: optional initial dictionary of preferences. The key is the name of persons
+        :param n: how many similar items to keep per item, like calculate_similar_items
+        :param score: score kernel from rating_matrix, e.g. SIMILARITY_KERNELS[sim_distance]
+        """
+        self.n = n
+        self.score = score
+        # user -> {item: rating}, the preferences dictionary after every event applied so far
+        self.preferences = {}
+        # item -> number of users that rated it
+        self.item_counts = {}
+        # item -> {other item: statistics}. Both items share the same statistics list,
+        # with the ratings of the item that sorts first as sum1
+        self.pair_statistics = {}
+        # the neighbour lists, same format as the result of calculate_similar_items
+        self.item_match = {}
+        self._names_descending = None
+        if preferences:
+            self.apply((user, item, rating) for user, ratings in preferences.items()
+                       for item, rating in ratings.items())
+
+    def rate(self, user, item, rating):
+        """
+        Add or update one rating
+        :return: set of items whose neighbour lists changed
+        """
+        return self.apply([(user, item, rating)])
+
+    def remove(self, user, item):
+        """
+        Delete one rating
+        :return: set of items whose neighbour lists changed
+        """
+        return self.apply([(user, item, None)])
+
+    def apply(self, events):
+        """
+        Apply a stream of rating events and then patch the neighbour lists of the affected items
+        :param events: iterable of (user, item, rating). A rating of None deletes the rating
+        :return: set of items whose neighbour lists were computed again
+        """
+        dirty = set()
+        items_changed = False
+        for user, item, rating in events:
+            ratings = self.preferences.setdefault(user, {})
+            old = ratings.get(item)
+            if old is None and rating is None:
+                continue
+            for other, other_rating in ratings.items():
+                if other == item:
+                    continue
+                self._update_pair(item, other, old, rating, other_rating)
+                dirty.add(other)
+            dirty.add(item)
+            # tanimoto also depends on how many users rated each item, so a new or deleted rating
+            # changes the score of item against every item it shares a rater with
+            if self.score is tanimoto_score and (old is None or rating is None):
+                dirty.update(self.pair_statistics.get(item, ()))
+
+            if rating is None:
+                del ratings[item]
+                if not ratings:
+                    del self.preferences[user]
+                self.item_counts[item] -= 1
+                if self.item_counts[item] == 0:
+                    del self.item_counts[item]
+                    items_changed = True
+            else:
+                ratings[item] = rating
+                if old is None:
+                    if item not in self.item_counts:
+                        self.item_counts[item] = 0
+                        items_changed = True
+                    self.item_counts[item] += 1
+
+        if items_changed:
+            self._names_descending = None
+            for item in list(self.item_match):
+                if item not in self.item_counts:
+                    del self.item_match[item]
+                    continue
+                # items with no co-raters score 0 by name, so lists holding such entries can change too
+                scores = self.item_match[item]
+                if len(scores) < self.n or (scores and scores[-1][0] <= 0):
+                    dirty.add(item)
+
+        dirty &= set(self.item_counts)
+        for item in dirty:
+            self.item_match[item] = self.top_matches(item)
+        return dirty
+
+    def _update_pair(self, item, other, old, new, other_rating):
+        # remove the old contribution of item and add the new one
+        if item < other:
+            first, second = item, other
+        else:
+            first, second = other, item
+        pairs = self.pair_statistics.setdefault(first, {})
+        s = pairs.get(second)
+        if s is None:
+            s = [0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+            pairs[second] = s
+            self.pair_statistics.setdefault(second, {})[first] = s
+        for rating, sign in ((old, -1), (new, 1)):
+            if rating is None:
+                continue
+            if item < other:
+                x, y = rating, other_rating
+            else:
+                x, y = other_rating, rating
+            s[0] += sign
+            s[1] += sign * x
+            s[2] += sign * y
+            s[3] += sign * x * x
+            s[4] += sign * y * y
+            s[5] += sign * x * y
+            s[6] += sign * (x - y) * (x - y)
+        if s[0] == 0:
+            del self.pair_statistics[first][second]
+            del self.pair_statistics[second][first]
+
+    def top_matches(self, item):
+        """
+        The n most similar items to item from the current statistics
+        Items with no common raters score 0, exactly like top_matches in recommendations.py
+        :param item: item name
+        :return: [(score, other item), ...] from highest to lowest
+        """
+        n = self.n
+        heap = []
+        if n <= 0:
+            return heap
+        counts = self.item_counts
+        pairs = self.pair_statistics.get(item, {})
+        for other, s in pairs.items():
+            push_bounded(heap, (self.score(s, counts[item], counts[other]), other), n)
+
+        if len(heap) < n or heap[0][0] <= 0:
+            if self._names_descending is None:
+                self._names_descending = sorted(counts, reverse=True)
+            for other in self._names_descending:
+                entry = (0, other)
+                if len(heap) == n and entry <= heap[0]:
+                    break
+                if other == item or other in pairs:
+                    continue
+                push_bounded(heap, entry, n)
+        return sorted(heap, reverse=True)
+
+    def rebuild(self):
+        """
+        Compute every neighbour list again from scratch. Useful once in a while to drop the floating point
+        error that many updates of the same pair statistics pile up
+        :return: None
+        """
+        preferences = self.preferences
+        self.__init__(preferences, self.n, self.score)
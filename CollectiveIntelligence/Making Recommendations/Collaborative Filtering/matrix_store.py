@@ -0,0 +1,226 @@
+import mmap
+import os
+import struct
+
+"""
+Persistent binary store for a RatingMatrix and the item_match table of calculate_similar_items
+The file is opened with mmap, so serving processes read ratings and neighbour lists straight from the page
+cache instead of loading them on the heap, and many processes share one copy of it.
+
+Layout, all numbers little endian:
+    header      magic, version, users, items, ratings, neighbours per item, then the offset of every section
+    user names  id dictionary: uint64 offsets into a UTF-8 blob in row order, plus an int32 permutation
+                that lists the rows by name so a name is found by binary search
+    item names  same as user names
+    ratings     CSR arrays: uint64 indptr, int32 item indices, float64 ratings
+    neighbours  fixed width table with k slots per item: int32 item indices (-1 for an empty slot),
+                then float64 scores
+"""
+
+MAGIC = 'CIRS'
+VERSION = 1
+SECTIONS = ('user_offsets', 'user_order', 'user_blob', 'item_offsets', 'item_order', 'item_blob',
+            'indptr', 'indices', 'values', 'neighbours')
+HEADER = struct.Struct('<4sIIIQI' + 'Q' * len(SECTIONS))
+CHUNK = 1 << 16
+
+
+def _encode(name):
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+
+def _decode(raw):
+    # plain ascii names come back as str, like the keys of critics
+    try:
+        raw.decode('ascii')
+        return raw
+    except UnicodeDecodeError:
+        return raw.decode('utf-8')
+
+
+def _write_array(out, code, values):
+    for start in range(0, len(values), CHUNK):
+        chunk = values[start:start + CHUNK]
+        out.write(struct.pack('<%d%s' % (len(chunk), code), *chunk))
+
+
+def _write_names(out, names):
+    """
+    Write one id dictionary
+    :return: offsets of its (offsets, order, blob) sections
+    """
+    encoded = [_encode(name) for name in names]
+    offsets = [0]
+    for raw in encoded:
+        offsets.append(offsets[-1] + len(raw))
+    order = sorted(range(len(encoded)), key=encoded.__getitem__)
+
+    sections = [out.tell()]
+    _write_array(out, 'Q', offsets)
+    sections.append(out.tell())
+    _write_array(out, 'i', order)
+    sections.append(out.tell())
+    for raw in encoded:
+        out.write(raw)
+    return sections
+
+
+def save_store(filename, matrix, item_match=None):
+    """
+    Write a rating matrix and optionally its neighbour lists to filename
+    The file is written next to its final name and moved in place, so readers never see half a file
+    :param filename: path of the store
+    :param matrix: RatingMatrix with users as rows, RatingMatrix.from_preferences(critics)
+    :param item_match: optional result of calculate_similar_items for the same preferences
+    :return: None
+    """
+    item_match = item_match or {}
+    k = max([len(scores) for scores in item_match.values()] or [0])
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as out:
+        out.write('\0' * HEADER.size)
+        sections = _write_names(out, matrix.row_ids) + _write_names(out, matrix.column_ids)
+
+        sections.append(out.tell())
+        _write_array(out, 'Q', matrix.indptr)
+        sections.append(out.tell())
+        _write_array(out, 'i', matrix.indices)
+        sections.append(out.tell())
+        _write_array(out, 'd', matrix.values)
+
+        sections.append(out.tell())
+        column_index = matrix.column_index
+        for item in matrix.column_ids:
+            scores = item_match.get(item, [])
+            padding = k - len(scores)
+            out.write(struct.pack('<%di' % k, *([column_index[item2] for score, item2 in scores] + [-1] * padding)))
+            out.write(struct.pack('<%dd' % k, *([score for score, item2 in scores] + [0.0] * padding)))
+
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, len(matrix.row_ids), len(matrix.column_ids), len(matrix.indices), k,
+                              *sections))
+    os.rename(temporary, filename)
+
+
+class MappedStore(object):
+    def __init__(self, filename):
+        """
+        Open a store written by save_store. Only the header is parsed, everything else is read on demand
+        :param filename: path of the store
+        """
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.buffer, 0)
+        if header[0] != MAGIC or header[1] != VERSION:
+            raise ValueError('{} is not a rating store'.format(filename))
+        self.user_count, self.item_count, self.rating_count, self.k = header[2:6]
+        self.sections = dict(zip(SECTIONS, header[6:]))
+        self.preferences = RatingsView(self)
+        self.item_match = NeighboursView(self)
+
+    def close(self):
+        self.buffer.close()
+
+    def _read(self, section, code, start, count):
+        size = struct.calcsize('<' + code)
+        return struct.unpack_from('<%d%s' % (count, code), self.buffer, self.sections[section] + start * size)
+
+    def _name(self, prefix, i):
+        start, end = self._read(prefix + '_offsets', 'Q', i, 2)
+        blob = self.sections[prefix + '_blob']
+        return _decode(self.buffer[blob + start:blob + end])
+
+    def _lookup(self, prefix, count, name):
+        # binary search of the id dictionary, sorted by encoded name
+        raw = _encode(name)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            i = self._read(prefix + '_order', 'i', middle, 1)[0]
+            start, end = self._read(prefix + '_offsets', 'Q', i, 2)
+            blob = self.sections[prefix + '_blob']
+            candidate = self.buffer[blob + start:blob + end]
+            if candidate == raw:
+                return i
+            if candidate < raw:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def user_index(self, name):
+        return self._lookup('user', self.user_count, name)
+
+    def item_index(self, name):
+        return self._lookup('item', self.item_count, name)
+
+    def user_name(self, i):
+        return self._name('user', i)
+
+    def item_name(self, i):
+        return self._name('item', i)
+
+    def ratings(self, i):
+        """
+        :param i: user index
+        :return: dictionary of item name -> rating
+        """
+        start, end = self._read('indptr', 'Q', i, 2)
+        items = self._read('indices', 'i', start, end - start)
+        values = self._read('values', 'd', start, end - start)
+        return dict((self.item_name(j), rating) for j, rating in zip(items, values))
+
+    def neighbours(self, i):
+        """
+        :param i: item index
+        :return: list of (score, item name) from highest to lowest, as in item_match
+        """
+        k = self.k
+        row = self.sections['neighbours'] + i * k * 12
+        items = struct.unpack_from('<%di' % k, self.buffer, row)
+        scores = struct.unpack_from('<%dd' % k, self.buffer, row + k * 4)
+        return [(score, self.item_name(j)) for j, score in zip(items, scores) if j >= 0]
+
+
+class RatingsView(object):
+    # Read only preferences dictionary backed by a MappedStore, one user is decoded per lookup
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, user):
+        i = self.store.user_index(user)
+        if i is None:
+            raise KeyError(user)
+        return self.store.ratings(i)
+
+    def __contains__(self, user):
+        return self.store.user_index(user) is not None
+
+    def __len__(self):
+        return self.store.user_count
+
+    def __iter__(self):
+        return (self.store.user_name(i) for i in range(self.store.user_count))
+
+
+class NeighboursView(object):
+    # Read only item_match dictionary backed by a MappedStore
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, item):
+        i = self.store.item_index(item)
+        if i is None:
+            raise KeyError(item)
+        return self.store.neighbours(i)
+
+    def __contains__(self, item):
+        return self.store.item_index(item) is not None
+
+    def __len__(self):
+        return self.store.item_count
+
+    def __iter__(self):
+        return (self.store.item_name(i) for i in range(self.store.item_count))
@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+
+from rating_matrix import pearson_score
+from similarity_engine import iter_tiles, score_tile, push_bounded, fill_with_zero_scores
+
+"""
+Parallel item similarity build
+The symmetric tiles of the all-pairs engine are dealt out in shards to a process pool.
+Each worker keeps bounded top-n heaps for the rows its tiles touch and the parent merges them
+"""
+
+# Read-only state of the running build. It is filled in before the pool is created, so forked workers
+# share the rating matrix copy-on-write instead of receiving a pickled copy with every shard
+_shared = {}
+
+
+def _init_worker(matrix, score, n):
+    # Platforms without fork start fresh interpreters, they get the matrix once per worker
+    _shared['matrix'] = matrix
+    _shared['score'] = score
+    _shared['n'] = n
+
+
+def _score_shard(tiles):
+    """
+    Score all tiles of one shard
+    :param tiles: list of tiles from iter_tiles
+    :return: dictionary of row index -> top-n heap of (score, other row name)
+    """
+    matrix, score, n = _shared['matrix'], _shared['score'], _shared['n']
+    row_ids = matrix.row_ids
+    heaps = {}
+    for tile in tiles:
+        for s, i, j in score_tile(matrix, tile, score):
+            push_bounded(heaps.setdefault(i, []), (s, row_ids[j]), n)
+            push_bounded(heaps.setdefault(j, []), (s, row_ids[i]), n)
+    return heaps
+
+
+def make_shards(n, tile_size, shards):
+    """
+    Deal the tiles round robin, so every shard gets blocks from the top and from the bottom of the matrix
+    :param n: number of rows
+    :param tile_size: rows per block
+    :param shards: number of shards
+    :return: list of lists of tiles
+    """
+    result = [[] for i in range(shards)]
+    for k, tile in enumerate(iter_tiles(n, tile_size)):
+        result[k % shards].append(tile)
+    return [shard for shard in result if shard]
+
+
+def parallel_top_matches(matrix, n=10, score=pearson_score, processes=None, tile_size=256, shards_per_process=4):
+    """
+    Same result as similarity_engine.all_pairs_top_matches, computed on a pool of processes
+    The result does not depend on the number of processes, since every heap keeps the n largest
+    (score, name) entries and that set is the same whatever order the shards are merged in
+    :param matrix: RatingMatrix
+    :param n: how many matches per row
+    :param score: score kernel from rating_matrix
+    :param processes: size of the pool, default is the number of cores
+    :param tile_size: rows per block
+    :param shards_per_process: more shards than processes keeps the pool busy when shards differ in cost
+    :return: dictionary of row name -> [(score, other row name), ...] from highest to lowest
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    row_ids = matrix.row_ids
+    heaps = [[] for i in range(len(row_ids))]
+    if n > 0:
+        shards = make_shards(len(row_ids), tile_size, processes * shards_per_process)
+        _init_worker(matrix, score, n)
+        if hasattr(os, 'fork'):
+            pool = multiprocessing.Pool(processes)
+        else:
+            pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(matrix, score, n))
+        try:
+            for partial in pool.imap_unordered(_score_shard, shards):
+                for i, heap in partial.items():
+                    for entry in heap:
+                        push_bounded(heaps[i], entry, n)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            _shared.clear()
+        fill_with_zero_scores(matrix, heaps, n)
+    return dict((row_ids[i], sorted(heap, reverse=True)) for i, heap in enumerate(heaps))
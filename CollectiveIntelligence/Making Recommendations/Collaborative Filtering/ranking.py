@@ -0,0 +1,51 @@
+from heapq import heapify, heappop, nlargest
+from itertools import islice
+
+"""
+Top-k selection shared by the ranking functions
+Rankings are (score, name) tuples ordered from highest to lowest, ties on score broken by name from
+highest to lowest, the same order as sort() followed by reverse()
+"""
+
+
+def top_k(candidates, n=None, lazy=False):
+    """
+    The n best candidates in rank order
+    Only a heap of n entries is kept, so choosing 10 out of a million candidates does not sort them all
+    :param candidates: iterable of (score, name)
+    :param n: how many to return, None returns all of them
+    :param lazy: return an iterator that orders the candidates as it is consumed, see iter_ranked
+    :return: list of (score, name) from highest to lowest, or an iterator over them when lazy
+    """
+    if lazy:
+        return islice(iter_ranked(candidates), None if n is None else max(n, 0))
+    if n is None:
+        return sorted(candidates, reverse=True)
+    if n <= 0:
+        return []
+    return nlargest(n, candidates)
+
+
+class _Descending(object):
+    # reverses the order of an entry so the min heap of heapq pops the highest one first
+    __slots__ = ('entry',)
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __lt__(self, other):
+        return other.entry < self.entry
+
+
+def iter_ranked(candidates):
+    """
+    Lazily yield candidates in rank order
+    Building the heap is linear and each entry costs log n when it is consumed, so a caller that stops
+    after the first few results never pays for ordering the rest
+    :param candidates: iterable of (score, name)
+    :return: generator of (score, name) from highest to lowest
+    """
+    heap = [_Descending(entry) for entry in candidates]
+    heapify(heap)
+    while heap:
+        yield heappop(heap).entry
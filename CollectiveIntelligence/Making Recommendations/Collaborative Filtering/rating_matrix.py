@@ -0,0 +1,202 @@
+from array import array
+from bisect import bisect_left
+from math import sqrt
+
+"""
+Sparse rating matrix used by the vectorized similarity functions
+A preferences dictionary of dictionaries is compiled once into id tables and CSR arrays, so scoring one row
+against every other row only walks the ratings that the rows actually have in common
+"""
+
+
+class RatingMatrix(object):
+    def __init__(self, row_ids, column_ids, indptr, indices, values):
+        """
+        Sparse, index-mapped copy of a preferences dictionary
+        Row i holds the ratings of row_ids[i], stored in CSR layout: its column indices are
+        indices[indptr[i]:indptr[i + 1]] and the matching ratings are values[indptr[i]:indptr[i + 1]]
+        A column major (CSC) copy of the same ratings is kept so we can find every row that rated a column
+        :param row_ids: list of row names (persons for user based filtering, items for item based)
+        :param column_ids: list of column names
+        :param indptr: array of row offsets, length is len(row_ids) + 1
+        :param indices: array of column indices, sorted inside each row
+        :param values: array of ratings
+        """
+        self.row_ids = row_ids
+        self.column_ids = column_ids
+        self.row_index = dict((name, i) for i, name in enumerate(row_ids))
+        self.column_index = dict((name, i) for i, name in enumerate(column_ids))
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.row_lengths = array('i', [indptr[i + 1] - indptr[i] for i in range(len(row_ids))])
+
+        # Column major copy: count ratings per column, then scatter rows into place
+        column_indptr = array('i', [0] * (len(column_ids) + 1))
+        for column in indices:
+            column_indptr[column + 1] += 1
+        for i in range(len(column_ids)):
+            column_indptr[i + 1] += column_indptr[i]
+        next_slot = array('i', column_indptr[:-1])
+        column_indices = array('i', [0] * len(indices))
+        column_values = array('d', [0.0] * len(indices))
+        for row in range(len(row_ids)):
+            for k in range(indptr[row], indptr[row + 1]):
+                column = indices[k]
+                slot = next_slot[column]
+                column_indices[slot] = row
+                column_values[slot] = values[k]
+                next_slot[column] += 1
+        self.column_indptr = column_indptr
+        self.column_indices = column_indices
+        self.column_values = column_values
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        """
+        Compile a preferences dictionary (like critics) into a RatingMatrix
+        :param preferences: the dictionary of preferences. The key is the name of persons
+        :return: RatingMatrix with one row per key of preferences
+        """
+        row_ids = sorted(preferences)
+        column_ids = sorted(set(item for ratings in preferences.values() for item in ratings))
+        column_index = dict((name, i) for i, name in enumerate(column_ids))
+
+        indptr = array('i', [0])
+        indices = array('i')
+        values = array('d')
+        for name in row_ids:
+            ratings = sorted((column_index[item], rating) for item, rating in preferences[name].items())
+            for column, rating in ratings:
+                indices.append(column)
+                values.append(rating)
+            indptr.append(len(indices))
+        return cls(row_ids, column_ids, indptr, indices, values)
+
+    def transpose(self):
+        """
+        Flip rows and columns, the matrix equivalent of transform_preferences
+        :return: RatingMatrix with one row per column of this matrix
+        """
+        return RatingMatrix(self.column_ids, self.row_ids, array('i', self.column_indptr),
+                            array('i', self.column_indices), array('d', self.column_values))
+
+    def row(self, name):
+        """
+        Ratings of one row
+        :param name: row name
+        :return: list of (column name, rating)
+        """
+        i = self.row_index[name]
+        return [(self.column_ids[self.indices[k]], self.values[k]) for k in range(self.indptr[i], self.indptr[i + 1])]
+
+    def to_preferences(self):
+        """
+        Convert back to a dictionary of dictionaries
+        :return: the dictionary of preferences
+        """
+        return dict((name, dict(self.row(name))) for name in self.row_ids)
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def __contains__(self, name):
+        return name in self.row_index
+
+
+def co_rating_statistics(matrix, row, start=0, end=None):
+    """
+    Walk the columns of one row once and accumulate its sufficient statistics against every other row
+    that shares at least one column with it
+    Rows without common columns are not in the result, every similarity function scores them 0
+    :param matrix: RatingMatrix
+    :param row: row index
+    :param start: only score rows with index >= start
+    :param end: only score rows with index < end, default is all rows
+    :return: dictionary of row index -> [n, sum1, sum2, sum1_square, sum2_square, product_sum, diff_square_sum]
+    """
+    indptr, indices, values = matrix.indptr, matrix.indices, matrix.values
+    column_indptr, column_indices, column_values = matrix.column_indptr, matrix.column_indices, matrix.column_values
+    if end is None:
+        end = len(matrix.row_ids)
+    bounded = start > 0 or end < len(matrix.row_ids)
+
+    statistics = {}
+    for k in range(indptr[row], indptr[row + 1]):
+        x = values[k]
+        column = indices[k]
+        first, last = column_indptr[column], column_indptr[column + 1]
+        if bounded:
+            # rows are sorted inside each column, so the requested range is a contiguous slice
+            first = bisect_left(column_indices, start, first, last)
+            last = bisect_left(column_indices, end, first, last)
+        for m in range(first, last):
+            other = column_indices[m]
+            if other == row:
+                continue
+            y = column_values[m]
+            s = statistics.get(other)
+            if s is None:
+                statistics[other] = [1, x, y, x * x, y * y, x * y, (x - y) * (x - y)]
+            else:
+                s[0] += 1
+                s[1] += x
+                s[2] += y
+                s[3] += x * x
+                s[4] += y * y
+                s[5] += x * y
+                s[6] += (x - y) * (x - y)
+    return statistics
+
+
+###
+# Similarity scores from sufficient statistics
+# Each one applies the same formula as its dictionary based counterpart in recommendations.py
+###
+def distance_score(statistics, length1, length2):
+    # removing ratings from patched statistics can leave a tiny negative sum of squares
+    return 1 / (1 + sqrt(max(statistics[6], 0)))
+
+
+# variances below this fraction of the sum of squares are floating point residue of a constant row
+VARIANCE_EPSILON = 1e-9
+
+
+def pearson_score(statistics, length1, length2):
+    n, sum1, sum2, sum1_square, sum2_square, product_sum = statistics[:6]
+    # a single common rating has no variance, sim_pearson scores it 0 too
+    if n < 2:
+        return 0
+    variance1 = sum1_square - pow(sum1, 2) / n
+    variance2 = sum2_square - pow(sum2, 2) / n
+    # statistics patched by many updates carry rounding error, which can leave a tiny variance for constant ratings
+    if variance1 <= VARIANCE_EPSILON * sum1_square or variance2 <= VARIANCE_EPSILON * sum2_square:
+        return 0
+    r = (product_sum - (sum1 * sum2 / n)) / sqrt(variance1 * variance2)
+    return max(-1.0, min(1.0, r))
+
+
+def tanimoto_score(statistics, length1, length2):
+    return statistics[0] / float(length1 + length2 - statistics[0])
+
+
+def cosine_score(statistics, length1, length2):
+    denominator = round(sqrt(statistics[3]), 3) * round(sqrt(statistics[4]), 3)
+    if denominator == 0:
+        return 0
+    return round(statistics[5] / float(denominator), 3)
+
+
+def score_all(matrix, name, score=pearson_score):
+    """
+    Score one row against all other rows in a single call
+    :param matrix: RatingMatrix
+    :param name: row name
+    :param score: one of distance_score, pearson_score, tanimoto_score, cosine_score
+    :return: dictionary of other row name -> similarity. Rows without common columns are left out, they score 0
+    """
+    row = matrix.row_index[name]
+    lengths = matrix.row_lengths
+    row_ids = matrix.row_ids
+    return dict((row_ids[other], score(s, lengths[row], lengths[other]))
+                for other, s in co_rating_statistics(matrix, row).items())
@@ -2,6 +2,12 @@ from data_storage import critics
 from math import sqrt
 import pprint
 
+from rating_matrix import RatingMatrix, score_all, distance_score, pearson_score, tanimoto_score, cosine_score
+from similarity_engine import all_pairs_top_matches
+from parallel_similarity import parallel_top_matches
+from ranking import top_k
+from batch_recommendations import iter_batch_recommendations
+
 
 ###
 # USER BASED COLLABORATION FILTER
@@ -99,7 +105,6 @@ def sim_tanimoto(preferences, person1, person2):
 def sim_tanimoto_sets(preferences, person1, person2):
     person1_set = set(preferences[person1])
     person2_set = set(preferences[person2])
-    print '{} preferences as a set {}'.format(person1, person1_set)
 
     length_of_common_movies = len(set.intersection(*[person1_set, person2_set]))
 
@@ -132,22 +137,62 @@ def sim_cosine(preferences, person1, person2):
     # Calculate cosine similarity using all preferences
     # x = preferences[person1].values()
     # y = preferences[person2].values()
-    print x, y
     numerator = sum(a * b for a, b in zip(x, y))
     denominator = square_rooted(x) * square_rooted(y)
     return round(numerator / float(denominator), 3)
 
 
-def top_matches(preferences, person, n=5, similarity=sim_pearson):
+###
+# VECTORIZED SIMILARITIES
+# Score one person against all others over a RatingMatrix (RatingMatrix.from_preferences(preferences))
+# They return the same numbers as the functions above, up to floating point rounding,
+# as a dictionary of other person -> score. People with no common preferences are left out since they score 0
+###
+def sim_distance_all(matrix, person):
+    return score_all(matrix, person, distance_score)
+
+
+def sim_pearson_all(matrix, person):
+    return score_all(matrix, person, pearson_score)
+
+
+def sim_tanimoto_all(matrix, person):
+    return score_all(matrix, person, tanimoto_score)
+
+
+def sim_cosine_all(matrix, person):
+    return score_all(matrix, person, cosine_score)
+
+
+# Score kernel of every similarity function, used to run it over a RatingMatrix
+SIMILARITY_KERNELS = {
+    sim_distance: distance_score,
+    sim_pearson: pearson_score,
+    sim_tanimoto: tanimoto_score,
+    sim_tanimoto_sets: tanimoto_score,
+    sim_cosine: cosine_score
+}
+
+
+def _candidates(index, preferences, person):
+    # a person added to preferences after the index was built is hashed from its ratings
+    return index.candidates(person, None if person in index else preferences[person])
+
+
+def top_matches(preferences, person, n=5, similarity=sim_pearson, index=None, lazy=False):
     """
     Returns the best matches for person from the preferences dictionary
     :param preferences: the dictionary of preferences. The key is the name of persons
     :param person:
     :param n:
     :param similarity: Which similarity function should be used
+    :param index: optional ann_index.LSHIndex, only the candidates it returns are scored
+    :param lazy: return an iterator over all matches in rank order, n limits it. Candidates are only put in order
+        as the caller consumes them, see ranking.iter_ranked
     :return:
     """
-    scores = [(similarity(preferences, name, person), name) for name in preferences if name != person]
+    names = preferences if index is None else _candidates(index, preferences, person)
+    scores = ((similarity(preferences, name, person), name) for name in names if name != person)
 
     # # Equivalent
     # for name in preferences:
@@ -156,22 +201,24 @@ def top_matches(preferences, person, n=5, similarity=sim_pearson):
     #         sc = similarity(preferences, name, person)
     #         print ('Add sc {} for {}'.format(sc,name))
     #         scores.append((sc,name))
-    scores.sort()
-    scores.reverse()
-    return scores[0:n]
+    return top_k(scores, n, lazy)
 
 
-def get_recommendations(preferences, person, similarity=sim_pearson):
+def get_recommendations(preferences, person, similarity=sim_pearson, index=None, n=None, lazy=False):
     """
     Recommend movies for a person
     :param preferences: the dictionary of preferences. The key is the name of persons
     :param person:
     :param similarity:
+    :param index: optional ann_index.LSHIndex, only the candidates it returns are used as neighbours
+    :param n: how many movies to return, None returns all of them
+    :param lazy: return an iterator in rank order that only orders the movies the caller consumes
     :return: list of movies
     """
     totals = {}
     sim_sums = {}
-    for other in preferences:
+    others = preferences if index is None else _candidates(index, preferences, person)
+    for other in others:
         if other == person:
             continue
         sim = similarity(preferences, person, other)
@@ -190,11 +237,32 @@ def get_recommendations(preferences, person, similarity=sim_pearson):
                 sim_sums[item] += sim
 
     # Normalize the sums
-    rankings = [(total / sim_sums[item], item) for item, total in totals.items()]
+    rankings = ((total / sim_sums[item], item) for item, total in totals.items())
+
+    return top_k(rankings, n, lazy)
+
+
+def get_recommendations_batch(preferences, people=None, similarity=sim_pearson, n=None):
+    """
+    Recommend movies for many persons at once, the same rankings as calling get_recommendations for each of them
+    Similarities with a kernel in SIMILARITY_KERNELS run over a RatingMatrix built once for the whole batch, and
+    every pair of persons is scored once. Any other similarity function falls back to one get_recommendations
+    call per person
+    :param preferences: the dictionary of preferences. The key is the name of persons
+    :param people: list of persons, default is everybody in preferences
+    :param similarity:
+    :param n: how many movies per person, None returns all of them
+    :return: generator of (person, list of movies), one person at a time so the rankings are never all in memory.
+        dict() of it gives the dictionary of person -> list of movies
+    """
+    if people is None:
+        people = list(preferences)
+    if similarity not in SIMILARITY_KERNELS:
+        return ((person, get_recommendations(preferences, person, similarity, n=n)) for person in people)
 
-    rankings.sort()
-    rankings.reverse()
-    return rankings
+    matrix = RatingMatrix.from_preferences(preferences)
+    rows = [matrix.row_index[person] for person in people]
+    return iter_batch_recommendations(matrix, rows, SIMILARITY_KERNELS[similarity], n)
 
 
 def transform_preferences(preferences):
@@ -217,14 +285,34 @@ def transform_preferences(preferences):
 ###
 # Item Based Collaboration Filtering
 ###
-def calculate_similar_items(preferences, n=10, similarity=sim_pearson):
+def print_progress(done, total):
+    # status updates for large datasets
+    if done < total:
+        print "%d / %d" % (done, total)
+
+
+def calculate_similar_items(preferences, n=10, similarity=sim_pearson, tile_size=256, processes=1,
+                            progress=print_progress):
     """
     Calculate and return a dictionary with Items scores
+    Similarities with a kernel in SIMILARITY_KERNELS go through the all-pairs engine, which scores every pair
+    of items once. Any other similarity function falls back to one top_matches call per item
     :param preferences: the dictionary of preferences. The key is the item
     :param n: how many items
     :param similarity: which similarity function should create
+    :param tile_size: items per block of the all-pairs engine
+    :param processes: run the all-pairs engine on a pool of that many processes, None uses every core
+    :param progress: optional function (done, total) for status updates, None is silent
     :return:
     """
+    if similarity in SIMILARITY_KERNELS:
+        item_matrix = RatingMatrix.from_preferences(preferences).transpose()
+        if processes != 1:
+            return parallel_top_matches(item_matrix, n=n, score=SIMILARITY_KERNELS[similarity], processes=processes,
+                                        tile_size=tile_size)
+        return all_pairs_top_matches(item_matrix, n=n, score=SIMILARITY_KERNELS[similarity], tile_size=tile_size,
+                                     progress=progress)
+
     # create a dictionary of items showing which other items they are most similar to
     result = {}
 
@@ -233,20 +321,22 @@ def calculate_similar_items(preferences, n=10, similarity=sim_pearson):
     for item in item_preferences:
         # status updates for large datasets
         c += 1
-        if c % 100 == 0:
-            print "%d / %d" % (c, len(item_preferences))
+        if progress is not None and c % 100 == 0:
+            progress(c, len(item_preferences))
         # find the most similar items to this one
         scores = top_matches(item_preferences, item, n=n, similarity=similarity)
         result[item] = scores
     return result
 
 
-def get_recommended_items(preferences, item_match, user):
+def get_recommended_items(preferences, item_match, user, n=None, lazy=False):
     """
     Return a list of recommended items
     :param preferences:the dictionary of preferences. The key is the name of the user
     :param item_match: the result of  calculate_similar_items
     :param user: user name
+    :param n: how many items to return, None returns all of them
+    :param lazy: return an iterator in rank order that only orders the items the caller consumes
     :return: a list
     """
     # get ratings of items from user
@@ -271,12 +361,10 @@ def get_recommended_items(preferences, item_match, user):
             total_sim[item2] += similarity
 
     # Divide each total score by total weighting to get an average
-    rankings = [(score / total_sim[item], item) for item, score in scores.items()]
+    rankings = ((score / total_sim[item], item) for item, score in scores.items())
 
     # Return the rankings from highest to lowest
-    rankings.sort()
-    rankings.reverse()
-    return rankings
+    return top_k(rankings, n, lazy)
 
 
 # Main Method to compare distances
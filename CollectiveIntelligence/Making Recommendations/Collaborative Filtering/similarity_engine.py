@@ -0,0 +1,131 @@
+from heapq import heappush, heapreplace
+
+from rating_matrix import co_rating_statistics, pearson_score
+
+"""
+All-pairs similarity engine
+Rows of a RatingMatrix are split in blocks and only the tiles on and above the diagonal are scored,
+so every pair of rows is computed once and its score is pushed to the neighbour heaps of both rows
+"""
+
+
+def iter_tiles(n, tile_size=256):
+    """
+    Symmetric tiles of an n x n similarity matrix
+    :param n: number of rows
+    :param tile_size: rows per block
+    :return: generator of (i_start, i_end, j_start, j_end) with j_start >= i_start
+    """
+    for i_start in range(0, n, tile_size):
+        i_end = min(i_start + tile_size, n)
+        for j_start in range(i_start, n, tile_size):
+            yield i_start, i_end, j_start, min(j_start + tile_size, n)
+
+
+def score_tile(matrix, tile, score=pearson_score):
+    """
+    Score every pair (i, j) with i < j inside one tile that shares at least one column
+    :param matrix: RatingMatrix
+    :param tile: (i_start, i_end, j_start, j_end) as returned by iter_tiles
+    :param score: score kernel from rating_matrix
+    :return: list of (score, i, j)
+    """
+    i_start, i_end, j_start, j_end = tile
+    lengths = matrix.row_lengths
+    scores = []
+    for i in range(i_start, i_end):
+        statistics = co_rating_statistics(matrix, i, max(j_start, i + 1), j_end)
+        for j, s in statistics.items():
+            scores.append((score(s, lengths[i], lengths[j]), i, j))
+    return scores
+
+
+def iter_pair_scores(matrix, score=pearson_score, tile_size=256):
+    """
+    Stream the scores of all pairs of rows, tile by tile. Each pair is scored once
+    :param matrix: RatingMatrix
+    :param score: score kernel from rating_matrix
+    :param tile_size: rows per block
+    :return: generator of (tile, list of (score, i, j))
+    """
+    for tile in iter_tiles(len(matrix), tile_size):
+        yield tile, score_tile(matrix, tile, score)
+
+
+def push_bounded(heap, entry, n):
+    """
+    Keep the n largest entries seen so far in a min heap
+    :param heap: list used as heap
+    :param entry: (score, name)
+    :param n: heap capacity
+    :return: None
+    """
+    if len(heap) < n:
+        heappush(heap, entry)
+    elif entry > heap[0]:
+        heapreplace(heap, entry)
+
+
+def _shares_column(matrix, columns, j):
+    indices = matrix.indices
+    for k in range(matrix.indptr[j], matrix.indptr[j + 1]):
+        if indices[k] in columns:
+            return True
+    return False
+
+
+def fill_with_zero_scores(matrix, heaps, n):
+    """
+    top_matches scores rows without common columns as 0, ranked by name like any other score.
+    Pad every heap with those zero entries where they would make it into the top n
+    :param matrix: RatingMatrix
+    :param heaps: list of heaps, one per row
+    :param n: heap capacity
+    :return: None
+    """
+    row_ids = matrix.row_ids
+    by_name_descending = sorted(range(len(row_ids)), key=row_ids.__getitem__, reverse=True)
+    for i, heap in enumerate(heaps):
+        # no zero score can enter a full heap whose lowest score is positive
+        if len(heap) == n and heap[0][0] > 0:
+            continue
+        columns = None
+        for j in by_name_descending:
+            if j == i:
+                continue
+            entry = (0, row_ids[j])
+            # names only get smaller from here on
+            if len(heap) == n and entry <= heap[0]:
+                break
+            if columns is None:
+                columns = set(matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]])
+            # rows sharing a column already got their real score
+            if _shares_column(matrix, columns, j):
+                continue
+            push_bounded(heap, entry, n)
+
+
+def all_pairs_top_matches(matrix, n=10, score=pearson_score, tile_size=256, progress=None):
+    """
+    The n best matches for every row, the same result as calling top_matches for each one of them
+    Memory is bounded by rows x n, since only one tile of scores is alive at a time
+    :param matrix: RatingMatrix
+    :param n: how many matches per row
+    :param score: score kernel from rating_matrix
+    :param tile_size: rows per block
+    :param progress: optional callable(rows_done, total_rows) called after each block of rows
+    :return: dictionary of row name -> [(score, other row name), ...] from highest to lowest
+    """
+    row_ids = matrix.row_ids
+    total = len(row_ids)
+    heaps = [[] for i in range(total)]
+    if n > 0:
+        for tile, scores in iter_pair_scores(matrix, score, tile_size):
+            for s, i, j in scores:
+                push_bounded(heaps[i], (s, row_ids[j]), n)
+                push_bounded(heaps[j], (s, row_ids[i]), n)
+            # the last tile of a row block completes it
+            if progress is not None and tile[3] == total:
+                progress(tile[1], total)
+        fill_with_zero_scores(matrix, heaps, n)
+    return dict((row_ids[i], sorted(heap, reverse=True)) for i, heap in enumerate(heaps))
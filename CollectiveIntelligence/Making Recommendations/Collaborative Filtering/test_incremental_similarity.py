@@ -0,0 +1,62 @@
+import random
+import unittest
+
+from incremental_similarity import IncrementalItemSimilarity
+from recommendations import calculate_similar_items, sim_distance, sim_pearson, SIMILARITY_KERNELS
+
+"""
+Random rating events applied incrementally against calculate_similar_items from scratch
+    python -m unittest test_incremental_similarity
+"""
+
+# ratings with no exact binary representation, so the pair statistics pile up rounding error
+RATINGS = [0.1, 1.3, 2.7, 3.3, 4.1, 4.9]
+
+
+class IncrementalSimilarityTest(unittest.TestCase):
+    def check(self, similarity, events=3000, seed=0):
+        rng = random.Random(seed)
+        users = ['u%d' % i for i in range(12)]
+        items = ['i%d' % i for i in range(20)]
+        n = 5
+        incremental = IncrementalItemSimilarity(n=n, score=SIMILARITY_KERNELS[similarity])
+        preferences = {}
+        for step in range(events):
+            user, item = rng.choice(users), rng.choice(items)
+            # mostly deletions once the matrix is half full, so pairs often drop back to 1 or 2 co-ratings
+            if item in preferences.get(user, {}) and rng.random() < 0.6:
+                incremental.remove(user, item)
+                del preferences[user][item]
+                if not preferences[user]:
+                    del preferences[user]
+            else:
+                rating = rng.choice(RATINGS)
+                incremental.rate(user, item, rating)
+                preferences.setdefault(user, {})[item] = rating
+            if step % 100 == 0:
+                self.compare(incremental, preferences, similarity, n)
+        self.compare(incremental, preferences, similarity, n)
+
+    def compare(self, incremental, preferences, similarity, n):
+        rated = set(item for ratings in preferences.values() for item in ratings)
+        self.assertEqual(set(incremental.item_match), rated)
+        full = calculate_similar_items(preferences, n=len(rated), similarity=similarity)
+        for item, expected in full.items():
+            actual = incremental.item_match[item]
+            scores = dict((other, score) for score, other in expected)
+            for score, other in actual:
+                self.assertTrue(-1 <= score <= 1, (item, other, score))
+                self.assertAlmostEqual(score, scores[other], places=6, msg=(item, other))
+            # same top scores, the names may swap among ties
+            self.assertEqual([round(score, 6) for score, other in actual],
+                             [round(score, 6) for score, other in expected[:n]])
+
+    def test_pearson(self):
+        self.check(sim_pearson)
+
+    def test_distance(self):
+        self.check(sim_distance, seed=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,294 @@
+from array import array
+from itertools import imap
+from math import sqrt
+from operator import add, mul, sub
+
+from fast_k_means import fast_k_means
+from linkage_clustering import linkage_cluster
+from utilities import normalize_row
+
+"""
+BIRCH: single pass clustering of more rows than fit in memory
+Rows are streamed into a CF-tree. Every leaf entry is a clustering feature (number of rows, linear sum, sum of
+squares) that summarises a tight group of rows, and two clustering features merge exactly by adding them up.
+A row is absorbed by its closest leaf entry when the radius of the entry stays under the threshold, otherwise it
+starts a new entry. When there are more than max_entries leaf entries the threshold is raised and the tree is
+rebuilt from its own entries, so memory stays bounded whatever the number of rows.
+The leaf entries are then clustered by linkage_cluster or fast_k_means, the global phase, each entry weighted by
+the number of rows it summarises, and a second pass over the rows can label every row with the cluster of its
+closest entry.
+By default rows are mean-centred and scaled to unit length first, so the Euclidean distances of the tree follow
+the Pearson distance used by the rest of the package
+"""
+
+
+class ClusteringFeature(object):
+    __slots__ = ('n', 'linear_sum', 'squared_sum', 'linear_norm')
+
+    def __init__(self, n, linear_sum, squared_sum):
+        """
+        :param n: number of rows
+        :param linear_sum: array('d'), sum of the rows
+        :param squared_sum: sum of the squared norms of the rows
+        """
+        self.n = n
+        self.linear_sum = linear_sum
+        self.squared_sum = squared_sum
+        # squared norm of linear_sum, so a distance costs one dot product
+        self.linear_norm = sum(imap(mul, linear_sum, linear_sum))
+
+    @classmethod
+    def from_row(cls, row):
+        row = array('d', row)
+        return cls(1, row, sum(imap(mul, row, row)))
+
+    def copy(self):
+        return ClusteringFeature(self.n, array('d', self.linear_sum), self.squared_sum)
+
+    def add(self, other):
+        self.linear_sum = array('d', imap(add, self.linear_sum, other.linear_sum))
+        self.linear_norm = sum(imap(mul, self.linear_sum, self.linear_sum))
+        self.n += other.n
+        self.squared_sum += other.squared_sum
+
+    def centroid(self):
+        return [v / self.n for v in self.linear_sum]
+
+    def radius_with(self, other):
+        """
+        :return: radius of the union of the 2 groups, the root mean squared distance of their rows to its centroid
+        """
+        n = float(self.n + other.n)
+        merged_norm = self.linear_norm + 2 * sum(imap(mul, self.linear_sum, other.linear_sum)) + other.linear_norm
+        value = (self.squared_sum + other.squared_sum) / n - merged_norm / (n * n)
+        return sqrt(max(value, 0.0))
+
+    def distance(self, other):
+        """
+        :return: Euclidean distance between the 2 centroids
+        """
+        # |a / n - b / m|^2 expanded into dot products of the linear sums
+        n, m = float(self.n), float(other.n)
+        value = (self.linear_norm / (n * n) - 2 * sum(imap(mul, self.linear_sum, other.linear_sum)) / (n * m) +
+                 other.linear_norm / (m * m))
+        return sqrt(max(value, 0.0))
+
+
+class _Node(object):
+    __slots__ = ('leaf', 'features', 'children')
+
+    def __init__(self, leaf):
+        self.leaf = leaf
+        # leaf: one clustering feature per entry, inner node: the summary of every child
+        self.features = []
+        self.children = []
+
+
+def _closest(features, feature):
+    best, best_distance = 0, float('inf')
+    for i, other in enumerate(features):
+        d = other.distance(feature)
+        if d < best_distance:
+            best, best_distance = i, d
+    return best
+
+
+def _summary(features):
+    total = features[0].copy()
+    for feature in features[1:]:
+        total.add(feature)
+    return total
+
+
+def _split(node):
+    """
+    Split an overfull node around its 2 farthest entries
+    :return: tuple of 2 new nodes
+    """
+    features = node.features
+    seeds, farthest = (0, 1), -1.0
+    for i in range(len(features)):
+        for j in range(i + 1, len(features)):
+            d = features[i].distance(features[j])
+            if d > farthest:
+                seeds, farthest = (i, j), d
+    halves = (_Node(node.leaf), _Node(node.leaf))
+    for i, feature in enumerate(features):
+        side = 0 if feature.distance(features[seeds[0]]) <= feature.distance(features[seeds[1]]) else 1
+        if i in seeds:
+            side = seeds.index(i)
+        halves[side].features.append(feature)
+        if not node.leaf:
+            halves[side].children.append(node.children[i])
+    return halves
+
+
+class CFTree(object):
+    def __init__(self, threshold=0.5, branching=50, leaf_size=50, max_entries=2000, columns=None, normalize=True):
+        """
+        :param threshold: largest radius of a leaf entry
+        :param branching: largest number of children of an inner node
+        :param leaf_size: largest number of entries of a leaf
+        :param max_entries: largest number of leaf entries, the threshold grows to stay under it
+        :param columns: number of columns, needed for sparse rows given as {column index: count}
+        :param normalize: mean-centre and scale rows to unit length before inserting them
+        """
+        self.threshold = threshold
+        self.branching = branching
+        self.leaf_size = leaf_size
+        self.max_entries = max_entries
+        self.columns = columns
+        self.normalize = normalize
+        self.root = _Node(leaf=True)
+        self.entries = 0
+        self.rows = 0
+        self.rebuilds = 0
+
+    def prepare(self, row):
+        """
+        :param row: list of numbers or {column index: count}
+        :return: the point the tree stores for row
+        """
+        if isinstance(row, dict):
+            if self.columns is None:
+                raise ValueError('columns is needed for sparse rows')
+            dense = [0.0] * self.columns
+            for column, count in row.items():
+                dense[column] = count
+            row = dense
+        return normalize_row(row) if self.normalize else row
+
+    def insert(self, row):
+        self._insert(ClusteringFeature.from_row(self.prepare(row)))
+        self.rows += 1
+        while self.entries > self.max_entries:
+            self._rebuild()
+
+    def fit(self, rows):
+        """
+        :param rows: iterable of rows, e.g. a generator over a file
+        :return: self
+        """
+        for row in rows:
+            self.insert(row)
+        return self
+
+    def _insert(self, feature):
+        split = self._insert_into(self.root, feature)
+        if split is not None:
+            root = _Node(leaf=False)
+            for half in split:
+                root.features.append(_summary(half.features))
+                root.children.append(half)
+            self.root = root
+
+    def _insert_into(self, node, feature):
+        # the depth of the tree grows with the log of the number of entries, recursion stays shallow
+        if node.leaf:
+            if node.features:
+                i = _closest(node.features, feature)
+                if node.features[i].radius_with(feature) <= self.threshold:
+                    node.features[i].add(feature)
+                    return None
+            node.features.append(feature)
+            self.entries += 1
+            return _split(node) if len(node.features) > self.leaf_size else None
+
+        i = _closest(node.features, feature)
+        split = self._insert_into(node.children[i], feature)
+        if split is None:
+            node.features[i].add(feature)
+            return None
+        node.features[i:i + 1] = [_summary(half.features) for half in split]
+        node.children[i:i + 1] = list(split)
+        return _split(node) if len(node.children) > self.branching else None
+
+    def _rebuild(self):
+        # raise the threshold to the median radius an entry would get by merging with its closest neighbour in
+        # its leaf, so about half of the entries can merge
+        radii = []
+        for leaf in self._leaves():
+            for i, feature in enumerate(leaf.features):
+                others = [j for j in range(len(leaf.features)) if j != i]
+                if others:
+                    j = min(others, key=lambda j: leaf.features[j].distance(feature))
+                    radii.append(feature.radius_with(leaf.features[j]))
+        radii.sort()
+        median = radii[len(radii) // 2] if radii else 0.0
+        self.threshold = max(median, self.threshold * 1.05, 1e-9)
+        entries = self.leaf_entries()
+        self.root = _Node(leaf=True)
+        self.entries = 0
+        self.rebuilds += 1
+        for feature in entries:
+            self._insert(feature)
+
+    def _leaves(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.leaf:
+                yield node
+            else:
+                stack.extend(reversed(node.children))
+
+    def leaf_entries(self):
+        """
+        :return: list of the ClusteringFeature of every leaf entry, from the leftmost leaf to the rightmost
+        """
+        return [feature for leaf in self._leaves() for feature in leaf.features]
+
+
+def _nearest(point, centroids):
+    best, best_distance = 0, float('inf')
+    for i, centroid in enumerate(centroids):
+        differences = map(sub, point, centroid)
+        d = sum(imap(mul, differences, differences))
+        if d < best_distance:
+            best, best_distance = i, d
+    return best
+
+
+def assign_rows(tree, entry_labels, rows):
+    """
+    Second pass: label rows with the global cluster of their closest leaf entry
+    :param tree: CFTree the rows were inserted into
+    :param entry_labels: list with the global cluster of every entry of tree.leaf_entries()
+    :param rows: iterable of rows, e.g. the same generator over the file again
+    :return: generator of cluster labels, one per row
+    """
+    centroids = [feature.centroid() for feature in tree.leaf_entries()]
+    for row in rows:
+        yield entry_labels[_nearest(tree.prepare(row), centroids)]
+
+
+def birch(rows, threshold=0.5, branching=50, leaf_size=50, max_entries=2000, columns=None, normalize=True,
+          global_phase='hierarchical', k=4, linkage='average', seed=None):
+    """
+    Streaming front end for the clustering algorithms of this package
+    :param rows: iterable of rows, lists of numbers or {column index: count} with columns
+    :param threshold: see CFTree
+    :param branching: see CFTree
+    :param leaf_size: see CFTree
+    :param max_entries: see CFTree
+    :param columns: see CFTree
+    :param normalize: see CFTree
+    :param global_phase: 'hierarchical' runs linkage_cluster on the centroids of the leaf entries, 'k_means' runs
+        fast_k_means on them. Both weight an entry by its number of rows, an entry of 13 rows pulls the k-means
+        centroids and the average linkage distances 13 times as much as a single row
+    :param k: number of clusters of the k_means phase
+    :param linkage: linkage of the hierarchical phase. 'centroid' cannot take weights and treats every entry as
+        one row
+    :param seed: seed of the k_means phase
+    :return: tuple of the CFTree and the result of the global phase, a BiCluster tree whose leaf ids are entry
+        indices, or the best_matches and distances_from_centroids of the entries
+    """
+    tree = CFTree(threshold, branching, leaf_size, max_entries, columns, normalize).fit(rows)
+    entries = tree.leaf_entries()
+    centroids = [feature.centroid() for feature in entries]
+    weights = [feature.n for feature in entries]
+    if global_phase == 'hierarchical':
+        return tree, linkage_cluster(centroids, linkage=linkage, weights=weights if linkage != 'centroid' else None)
+    if global_phase == 'k_means':
+        return tree, fast_k_means(centroids, k=min(k, len(centroids)), seed=seed, weights=weights)
+    raise ValueError('Unknown global phase {}'.format(global_phase))
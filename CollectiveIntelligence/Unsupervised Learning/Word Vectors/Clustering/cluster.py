@@ -1,4 +1,7 @@
-class BiCluster:
+class BiCluster(object):
+    # no per node dictionary, trees of hundreds of thousands of nodes stay small
+    __slots__ = ('vec', 'left', 'right', 'distance', 'id', 'height', 'depth')
+
     def __init__(self, vec, left=None, right=None, distance=0.0, id=None):
         """
         Each cluster in hierarchical clustering algorithm is either a point in the tree with 2 branches (left and right) or an
@@ -14,6 +17,26 @@ class BiCluster:
         self.right = right
         self.distance = distance
         self.id = id
+        # number of leaves and largest distance down to a leaf, cached by tree_utilities.annotate
+        self.height = None
+        self.depth = None
+
+    def __getstate__(self):
+        # classes with __slots__ have no __dict__ for pickle to save
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
 
     def __str__(self):
-        return 'Cluster {}, Distance:{}, Left_Length:{}, Right_Length:{}'.format(self.id, self.distance, len(self.left.vec), len(self.right.vec))
\ No newline at end of file
+        return 'Cluster {}, Distance:{}, Left_Length:{}, Right_Length:{}'.format(self.id, self.distance,
+                                                                                 _vector_length(self.left),
+                                                                                 _vector_length(self.right))
+
+
+def _vector_length(node):
+    # trees from LinkageMatrix.to_bicluster without rows have no vectors
+    if node is None or node.vec is None:
+        return None
+    return len(node.vec)
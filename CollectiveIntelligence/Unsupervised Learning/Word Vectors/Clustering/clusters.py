@@ -1,16 +1,32 @@
 from dendogram import draw_dendogram
-from hierarchical_clustering import hierarchical_cluster
-from k_means_clustering import k_means_clustering
+from fast_k_means import fast_k_means
+from linkage_clustering import linkage_cluster
 from multidimensional_scaling import draw2d, scale_down
+from tree_utilities import iter_preorder
+
+# first line of a sparse word count file, see generate_feed_vector.save_sparse_word_list
+SPARSE_MAGIC = '#sparse'
 
 
 def read_file(filename):
     """
     Load file with word counts.
     In this file columns are words and each row represents each blog and count of words
+    Sparse files from save_sparse_word_list are expanded to the same dense rows
     :param filename:
     :return: a tuple of row names, column names and actual data
     """
+    if is_sparse_file(filename):
+        column_names, rows = iter_sparse_rows(filename)
+        row_names = []
+        data = []
+        for name, row in rows:
+            row_names.append(name)
+            dense = [0.0] * len(column_names)
+            for column, count in row.items():
+                dense[column] = count
+            data.append(dense)
+        return row_names, column_names, data
 
     lines = [line for line in file(filename)]  # Use list complrehension to load lines from file
 
@@ -21,7 +37,6 @@ def read_file(filename):
     for line in lines[1:]:
         p = line.strip().split('\t')
         # First column in each row is the rowname (or name of blogs)
-        print p[0]
         row_names.append(p[0])
         # The data for this row is the remainder of the row
         # data.append([float(x) for x in p[1:]])
@@ -31,31 +46,92 @@ def read_file(filename):
     return row_names, column_names, data
 
 
+def iter_sparse_rows(filename):
+    """
+    Stream the rows of a sparse word count file written by generate_feed_vector.save_sparse_word_list
+    The file is read line by line, only one row is in memory at a time
+    :param filename:
+    :return: tuple of column names and a generator of (row name, {column index: count})
+    """
+    f = open(filename)
+    if f.readline().rstrip('\r\n') != SPARSE_MAGIC:
+        f.close()
+        raise ValueError('{} is not a sparse word count file'.format(filename))
+    column_names = f.readline().rstrip('\r\n').split('\t')[1:]
+
+    def rows():
+        with f:
+            for line in f:
+                p = line.rstrip('\r\n').split('\t')
+                row = {}
+                for cell in p[1:]:
+                    column, count = cell.split(':')
+                    row[int(column)] = float(count)
+                yield p[0], row
+    return column_names, rows()
+
+
+def read_sparse_file(filename):
+    """
+    Load a sparse word count file
+    :param filename:
+    :return: a tuple of row names, column names and rows as dictionaries of column index -> count
+    """
+    column_names, rows = iter_sparse_rows(filename)
+    row_names = []
+    data = []
+    for name, row in rows:
+        row_names.append(name)
+        data.append(row)
+    return row_names, column_names, data
+
+
+def iter_rows(filename):
+    """
+    Stream the rows of a word count file of either format, only one row is in memory at a time
+    :param filename:
+    :return: tuple of column names and a generator of (row name, row). Rows of dense files are lists of numbers,
+        rows of sparse files {column index: count}
+    """
+    if is_sparse_file(filename):
+        return iter_sparse_rows(filename)
+    f = open(filename)
+    column_names = f.readline().strip().split('\t')[1:]
+
+    def rows():
+        with f:
+            for line in f:
+                p = line.strip().split('\t')
+                yield p[0], [float(x) for x in p[1:]]
+    return column_names, rows()
+
+
+def is_sparse_file(filename):
+    with open(filename) as f:
+        return f.readline().rstrip('\r\n') == SPARSE_MAGIC
+
+
 def print_clusters(clusters_to_print, labels=None, n=0):
     """
-    Print Clusters tree recursively
+    Print Clusters tree, parents before their branches
     :param clusters_to_print:
     :param labels:
-    :param n:
+    :param n: indentation of the root
     :return:
     """
-    # indent to make hierarchy layout
-    for i in range(n):
-        print '  '
-    if clusters_to_print.id < 0:
-        # negative ids mean that this is branch
-        print '-'
-    else:
-        # positive ids means that this is Endpoint
-        if labels is None:
-            print clusters_to_print.id
+    for cluster, level in iter_preorder(clusters_to_print):
+        # indent to make hierarchy layout
+        for i in range(n + level):
+            print '  '
+        if cluster.id < 0:
+            # negative ids mean that this is branch
+            print '-'
         else:
-            print labels[clusters_to_print.id]
-    # Now Print the Right and Left Branches
-    if clusters_to_print.left is not None:
-        print_clusters(clusters_to_print.left, labels=labels, n=n + 1)
-    if clusters_to_print.right is not None:
-        print_clusters(clusters_to_print.right, labels=labels, n=n + 1)
+            # positive ids means that this is Endpoint
+            if labels is None:
+                print cluster.id
+            else:
+                print labels[cluster.id]
 
 
 def rotate_matrix(data):
@@ -70,16 +146,16 @@ if __name__ == '__main__':
     print 'A. Hierarchical Clustering'
     print '1. Fetch data and create Hierarchical Clusters.'
     blog_names, words, data = read_file('../blogdata.txt')
-    clusters = hierarchical_cluster(data)
+    clusters = linkage_cluster(data, linkage='centroid')
     print_clusters(clusters, labels=blog_names)
     draw_dendogram(clusters, labels=blog_names, jpeg='blog_cluster.jpg')
 
     print '2. Lets rotate Matrix and do Column Clustering.'
     columnar_data = rotate_matrix(data)
-    columnar_clusters = hierarchical_cluster(columnar_data)
+    columnar_clusters = linkage_cluster(columnar_data, linkage='centroid')
     draw_dendogram(columnar_clusters, labels=words, jpeg='word_cluster.jpg')
     print ('3. K-Means Clustering')
-    k_cluster = k_means_clustering(data, k=20)
+    k_cluster, distances_from_centroids = fast_k_means(data, k=20, seed=0)
     print k_cluster
     for k in range(20):
         print '{} {}'.format(k, [blog_names[r] for r in k_cluster[k]])
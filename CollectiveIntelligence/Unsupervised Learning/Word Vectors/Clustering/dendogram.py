@@ -1,5 +1,7 @@
 from PIL import Image, ImageDraw
 
+import tree_utilities
+
 
 def get_height(cluster):
     """
@@ -7,11 +9,8 @@ def get_height(cluster):
     :param cluster: BiCluster
     :return: integer
     """
-    # if this is an endpoint then height is just 1
-    if cluster.left is None and cluster.right is None:
-        return 1
-    # otherwise lets calculate recursively the height of each branch
-    return get_height(cluster.left) + get_height(cluster.right)
+    # endpoints have a height of 1, branches the sum of their 2 branches, cached on the tree
+    return tree_utilities.height(cluster)
 
 
 def get_depth(cluster):
@@ -22,10 +21,8 @@ def get_depth(cluster):
     :param cluster:
     :return:
     """
-    if cluster.left is None and cluster.right is None:
-        return 0
-    # the distance of a branch is the max of the 2 branches plus its own distance
-    return max(get_depth(cluster.left), get_depth(cluster.right)) + cluster.distance
+    # the distance of a branch is the max of the 2 branches plus its own distance, cached on the tree
+    return tree_utilities.depth(cluster)
 
 
 def draw_dendogram(cluster, labels, jpeg='clusters.jpg', w=1200):
@@ -57,7 +54,7 @@ def draw_dendogram(cluster, labels, jpeg='clusters.jpg', w=1200):
 
 def draw_node(draw, cluster, x, y, scaling, labels):
     """
-
+    Draw cluster and everything below it, with a stack instead of recursion so deep trees can be drawn
     :param draw:
     :param cluster:
     :param x:
@@ -66,29 +63,33 @@ def draw_node(draw, cluster, x, y, scaling, labels):
     :param labels:
     :return:
     """
-    if cluster.id < 0:
-        height_left = get_height(cluster.left) * 20
-        height_right = get_height(cluster.right) * 20
-
-        top = y - (height_left + height_right) / 2
-        bottom = y + (height_left + height_right) / 2
-
-        line_length = cluster.distance * scaling
-
-        # Vertical line from this cluster to children
-        draw.line((x, top + height_left / 2, x, bottom - height_right / 2), fill=(255, 0, 0))
-
-        # Horizontal line to left item
-        draw.line((x, top + height_left / 2, x + line_length, top + height_left / 2), fill=(255, 0, 0))
-
-        # Horizontal line to right item
-        draw.line((x, bottom - height_right / 2, x + line_length, bottom - height_right / 2), fill=(255, 0, 0))
-
-        # Recursively draw left and right branches
-        if cluster.left is not None:
-            draw_node(draw, cluster.left, x + line_length, top + height_left / 2, scaling, labels)
-        if cluster.right is not None:
-            draw_node(draw, cluster.right, x + line_length, bottom - height_right / 2, scaling, labels)
-    else:
-        # if this is the endpoint
-        draw.text((x + 5, y - 7), labels[cluster.id], (0, 0, 0))
+    tree_utilities.annotate(cluster)
+    stack = [(cluster, x, y)]
+    while stack:
+        cluster, x, y = stack.pop()
+        if cluster.id < 0:
+            height_left = cluster.left.height * 20
+            height_right = cluster.right.height * 20
+
+            top = y - (height_left + height_right) / 2
+            bottom = y + (height_left + height_right) / 2
+
+            line_length = cluster.distance * scaling
+
+            # Vertical line from this cluster to children
+            draw.line((x, top + height_left / 2, x, bottom - height_right / 2), fill=(255, 0, 0))
+
+            # Horizontal line to left item
+            draw.line((x, top + height_left / 2, x + line_length, top + height_left / 2), fill=(255, 0, 0))
+
+            # Horizontal line to right item
+            draw.line((x, bottom - height_right / 2, x + line_length, bottom - height_right / 2), fill=(255, 0, 0))
+
+            # Draw left and right branches next, left first
+            if cluster.right is not None:
+                stack.append((cluster.right, x + line_length, bottom - height_right / 2))
+            if cluster.left is not None:
+                stack.append((cluster.left, x + line_length, top + height_left / 2))
+        else:
+            # if this is the endpoint
+            draw.text((x + 5, y - 7), labels[cluster.id], (0, 0, 0))
@@ -0,0 +1,267 @@
+from math import sqrt
+from random import Random
+
+from utilities import pearson_distance, normalize_row, normalize_rows, pearson_distances
+
+"""
+Optimized k-means engine, same result contract as k_means_clustering
+- k-means++ seeding picks centroids among the rows, far apart from each other, instead of random points in the
+  bounding box, so fewer passes are needed and fewer clusters end up empty
+- every row/centroid distance is computed once per pass, Pearson distances with the batched kernel of utilities
+- Hamerly pruning: for Pearson distance every row and centroid is a unit vector once normalized, and the chord
+  sqrt(2 * distance) between 2 of them is a metric. Each row keeps an upper bound on the chord to its centroid and
+  a lower bound on the chord to any other centroid. Bounds only move by how far centroids moved, and a row whose
+  upper bound stays below its lower bound cannot change cluster, so it is skipped without computing any distance
+- mini-batch mode updates centroids from a random sample of rows per iteration, for data too big for full passes
+- all randomness comes from one seedable Random, so runs are reproducible
+- optional row weights, e.g. the number of rows summarised by a BIRCH entry, count a row that many times
+"""
+
+
+def _chord(d):
+    # Euclidean distance between 2 unit vectors whose Pearson distance is d
+    return sqrt(max(2.0 * d, 0.0))
+
+
+def _mean(rows, members, weights=None):
+    total = [0.0] * len(rows[0])
+    for row_id in members:
+        row = rows[row_id]
+        w = weights[row_id] if weights is not None else 1
+        for m in range(len(row)):
+            total[m] += w * row[m]
+    size = sum(weights[row_id] for row_id in members) if weights is not None else len(members)
+    return [v / size for v in total]
+
+
+class _Space(object):
+    """
+    Distances between rows and centroids. Pearson distance goes through normalized vectors and the batched
+    kernel, any other distance function is called once per pair
+    """
+    def __init__(self, rows, distance):
+        self.rows = rows
+        self.distance = distance
+        self.pearson = distance is pearson_distance
+        self.normalized_rows = normalize_rows(rows) if self.pearson else None
+
+    def prepare(self, centroid):
+        return normalize_row(centroid) if self.pearson else centroid
+
+    def to_all(self, j, prepared):
+        """
+        :return: list of distances from row j to every prepared centroid
+        """
+        if self.pearson:
+            return pearson_distances(self.normalized_rows[j], prepared)
+        return [self.distance(centroid, self.rows[j]) for centroid in prepared]
+
+    def to_one(self, j, centroid):
+        if self.pearson:
+            return pearson_distances(self.normalized_rows[j], [centroid])[0]
+        return self.distance(centroid, self.rows[j])
+
+    def between(self, prepared1, prepared2):
+        if self.pearson:
+            return pearson_distances(prepared1, [prepared2])[0]
+        return self.distance(prepared1, prepared2)
+
+
+def k_means_plus_plus(rows, k, distance=pearson_distance, rng=None, space=None, weights=None):
+    """
+    k-means++ seeding: the first centroid is a random row, every next one is a row drawn with probability
+    proportional to its squared distance from the closest centroid picked so far, times its weight
+    :param rows: Data
+    :param k: number of centroids
+    :param distance: Distance Function
+    :param rng: random.Random instance
+    :param space: internal, shared with fast_k_means to normalize rows only once
+    :param weights: optional positive weight of every row
+    :return: list of k centroids, copies of rows
+    """
+    if k > len(rows):
+        raise ValueError('Cannot make {} clusters out of {} rows'.format(k, len(rows)))
+    rng = rng or Random()
+    space = space or _Space(rows, distance)
+    chosen = [rng.randrange(len(rows))]
+    # squared chord for Pearson distance is 2 * d
+    squared = (lambda d: d) if space.pearson else (lambda d: d * d)
+    if weights is None:
+        weights = [1] * len(rows)
+    first = space.prepare(rows[chosen[0]])
+    closest = [weights[i] * squared(space.to_one(i, first)) for i in range(len(rows))]
+    while len(chosen) < k:
+        total = sum(closest)
+        if total <= 0:
+            # every row sits on a centroid already
+            chosen.append(rng.choice([i for i in range(len(rows)) if i not in chosen]))
+        else:
+            target = rng.random() * total
+            cumulative = 0.0
+            pick = None
+            for i, w in enumerate(closest):
+                if w > 0:
+                    pick = i
+                    cumulative += w
+                    if cumulative >= target:
+                        break
+            chosen.append(pick)
+        new = space.prepare(rows[chosen[-1]])
+        for i in range(len(rows)):
+            closest[i] = min(closest[i], weights[i] * squared(space.to_one(i, new)))
+    return [list(rows[i]) for i in chosen]
+
+
+def _result(space, centroids, assignment, k):
+    best_matches = [[] for i in range(k)]
+    for j, i in enumerate(assignment):
+        best_matches[i].append(j)
+    distances_from_centroids = {}
+    for i in range(k):
+        prepared = space.prepare(centroids[i])
+        for j in best_matches[i]:
+            distances_from_centroids[j] = space.to_one(j, prepared)
+    return best_matches, distances_from_centroids
+
+
+def _lloyd(space, centroids, max_iterations, stats, weights=None):
+    rows = space.rows
+    k = len(centroids)
+    prepared = [space.prepare(c) for c in centroids]
+    # chord bounds are only valid for Pearson distance, any other distance gets a full pass each time
+    prune = space.pearson
+    assignment = [0] * len(rows)
+    upper = [0.0] * len(rows)
+    lower = [0.0] * len(rows)
+    for j in range(len(rows)):
+        ds = space.to_all(j, prepared)
+        stats['distances'] += k
+        best = ds.index(min(ds))
+        assignment[j] = best
+        if prune:
+            upper[j] = _chord(ds[best])
+            lower[j] = min([_chord(d) for i, d in enumerate(ds) if i != best] or [float('inf')])
+
+    for t in range(max_iterations):
+        stats['iterations'] = t + 1
+        # Move the centroids to the average of their members, empty clusters keep their centroid
+        members = [[] for i in range(k)]
+        for j, i in enumerate(assignment):
+            members[i].append(j)
+        moved = [0.0] * k
+        for i in range(k):
+            if members[i]:
+                centroids[i] = _mean(rows, members[i], weights)
+                new = space.prepare(centroids[i])
+                if prune:
+                    moved[i] = _chord(space.between(prepared[i], new))
+                prepared[i] = new
+
+        if prune:
+            largest = max(moved)
+            # half the chord from each centroid to its closest other centroid
+            half_gap = [float('inf')] * k
+            for i in range(k):
+                for i2 in range(i + 1, k):
+                    gap = _chord(space.between(prepared[i], prepared[i2])) / 2.0
+                    half_gap[i] = min(half_gap[i], gap)
+                    half_gap[i2] = min(half_gap[i2], gap)
+            stats['distances'] += k * (k - 1) // 2
+
+        changed = 0
+        for j in range(len(rows)):
+            best = assignment[j]
+            if prune:
+                upper[j] += moved[best]
+                lower[j] -= largest
+                bound = max(half_gap[best], lower[j])
+                if upper[j] <= bound:
+                    stats['pruned'] += 1
+                    continue
+                # tighten the upper bound before paying for a full pass over the centroids
+                upper[j] = _chord(space.to_one(j, prepared[best]))
+                stats['distances'] += 1
+                if upper[j] <= bound:
+                    stats['pruned'] += 1
+                    continue
+            ds = space.to_all(j, prepared)
+            stats['distances'] += k
+            new_best = ds.index(min(ds))
+            # keep the current centroid on ties, as the full pass of k_means_clustering would
+            if ds[best] == ds[new_best]:
+                new_best = best
+            if new_best != best:
+                assignment[j] = new_best
+                changed += 1
+            if prune:
+                upper[j] = _chord(ds[new_best])
+                lower[j] = min([_chord(d) for i, d in enumerate(ds) if i != new_best] or [float('inf')])
+        if changed == 0:
+            break
+    return assignment
+
+
+def _mini_batch(space, centroids, max_iterations, batch_size, rng, stats, weights=None):
+    """
+    Mini-batch k-means (Sculley 2010): each iteration assigns a random sample of rows and pulls every centroid
+    towards its sampled rows with a step of weight / total weight of the rows it has seen so far
+    """
+    rows = space.rows
+    k = len(centroids)
+    counts = [0] * k
+    for t in range(max_iterations):
+        stats['iterations'] = t + 1
+        prepared = [space.prepare(c) for c in centroids]
+        batch = [rng.randrange(len(rows)) for b in range(batch_size)]
+        nearest = []
+        for j in batch:
+            ds = space.to_all(j, prepared)
+            nearest.append(ds.index(min(ds)))
+        stats['distances'] += k * len(batch)
+        for j, i in zip(batch, nearest):
+            w = weights[j] if weights is not None else 1
+            counts[i] += w
+            step = float(w) / counts[i]
+            centroid = centroids[i]
+            row = rows[j]
+            for m in range(len(centroid)):
+                centroid[m] += step * (row[m] - centroid[m])
+
+    # one full pass for the final assignment
+    prepared = [space.prepare(c) for c in centroids]
+    assignment = []
+    for j in range(len(rows)):
+        ds = space.to_all(j, prepared)
+        assignment.append(ds.index(min(ds)))
+    stats['distances'] += k * len(rows)
+    return assignment
+
+
+def fast_k_means(rows, distance=pearson_distance, k=4, seed=None, max_iterations=100, batch_size=None,
+                 stats=None, weights=None):
+    """
+    k-means clustering with k-means++ seeding, pruned assignment and an optional mini-batch mode
+    :param rows: Data
+    :param distance: Distance Function, pruning applies to pearson_distance only
+    :param k: how many clusters do you want to make
+    :param seed: seed of the random generator, or a random.Random instance. Same seed, same clusters
+    :param max_iterations: maximum number of passes, or of mini-batches
+    :param batch_size: rows per mini-batch. None runs full passes until the assignments stop changing
+    :param stats: optional dictionary filled with 'iterations', 'distances' computed and rows 'pruned'
+    :param weights: optional positive weight of every row, a centroid is the weighted average of its rows
+    :return: tuple of best_matches, the list of row indices of every cluster, and distances_from_centroids,
+        the dictionary of row index -> distance to its centroid, as k_means_clustering
+    """
+    rng = seed if isinstance(seed, Random) else Random(seed)
+    if stats is None:
+        stats = {}
+    stats.update(iterations=0, distances=0, pruned=0)
+    space = _Space(rows, distance)
+    centroids = k_means_plus_plus(rows, k, distance, rng, space, weights)
+    stats['distances'] += len(rows) * len(centroids)
+    if batch_size is None:
+        assignment = _lloyd(space, centroids, max_iterations, stats, weights)
+    else:
+        assignment = _mini_batch(space, centroids, max_iterations, batch_size, rng, stats, weights)
+    best_matches, distances_from_centroids = _result(space, centroids, assignment, k)
+    return best_matches, distances_from_centroids
@@ -1,8 +1,9 @@
-from utilities import pearson_distance
+from instrumentation import SILENT
+from utilities import pearson_distance, normalize_rows, pearson_distances
 from random import random
 
 
-def k_means_clustering(rows, distance=pearson_distance, k=4):
+def k_means_clustering(rows, distance=pearson_distance, k=4, instrumentation=None):
     """
     k-means clustering algorithm begins with k randomly placed centroids
     and assigns every item to the nearest one.
@@ -12,8 +13,11 @@ def k_means_clustering(rows, distance=pearson_distance, k=4):
     :param rows: Data
     :param distance: Distance Function
     :param k: how many clusters do you want to make
+    :param instrumentation: optional Instrumentation, counts 'iterations' and 'distances' and reports 'iteration'
+        progress with the number of rows that changed cluster
     :return:
     """
+    instrumentation = instrumentation or SILENT
     # Determine the min and max values for each point
     ranges = [(min(row[i] for row in rows), max([row[i] for row in rows])) for i in range(len(rows[0]))]
 
@@ -23,20 +27,31 @@ def k_means_clustering(rows, distance=pearson_distance, k=4):
     distances_from_centroids = {}
     last_matches = None
     best_matches = None
+
+    # Pearson distances go through the batched kernel, rows are normalized only once
+    pearson = distance is pearson_distance
+    if pearson:
+        normalized_rows = normalize_rows(rows)
     for t in range(100):
-        print ('Iteration {}'.format(t))
         best_matches = [[] for i in range(k)]
+        if pearson:
+            normalized_clusters = normalize_rows(clusters)
 
         # Find the centroid that is the closest for each row
         for j in range(len(rows)):
-            row = rows[j]
-            best_match = 0
-            for i in range(k):
-                d = distance(clusters[i], row)
-                if d < distance(clusters[best_match], row):
-                    best_match = i
+            if pearson:
+                row_distances = pearson_distances(normalized_rows[j], normalized_clusters)
+            else:
+                row_distances = [distance(clusters[i], rows[j]) for i in range(k)]
+            best_match = row_distances.index(min(row_distances))
             best_matches[best_match].append(j)
 
+        instrumentation.count('iterations')
+        instrumentation.count('distances', k * len(rows))
+        if last_matches is not None:
+            moved = sum(len(set(members) - set(last)) for members, last in zip(best_matches, last_matches))
+            instrumentation.report('iteration', t + 1, 100, moved=moved)
+
         # if the results are the same as last time, then this is complete
         if best_matches == last_matches:
             break
@@ -56,6 +71,12 @@ def k_means_clustering(rows, distance=pearson_distance, k=4):
     # Chapter 3 Exercise 5: Return along with the cluster results the total distance between all items
     # and their respective centroids
     for i in range(k):
+        if pearson:
+            members = best_matches[i]
+            member_distances = pearson_distances(normalize_rows([clusters[i]])[0],
+                                                 [normalized_rows[j] for j in members])
+            distances_from_centroids.update(zip(members, member_distances))
+            continue
         for j in range(len(best_matches[i])):
             distances_from_centroids[best_matches[i][j]] = distance(clusters[i],rows[best_matches[i][j]])
     return best_matches, distances_from_centroids
@@ -0,0 +1,242 @@
+from array import array
+
+from instrumentation import SILENT
+from linkage_matrix import LinkageMatrix
+from utilities import pearson_distance, normalize_rows, normalize_row, pearson_distances, pairwise_pearson_distances
+
+"""
+Hierarchical clustering on a distance matrix that is computed once
+The n * (n - 1) / 2 distances between rows are stored in a condensed array. After each merge the distances of the
+new cluster follow from the distances of its two branches (Lance-Williams), so no pair is rescanned and no
+distance is computed again. Average, complete and single linkage are reducible, which lets the
+nearest-neighbour chain algorithm find the merges in O(n^2) time
+"""
+
+
+def _average(d_ak, d_bk, d_ab, size_a, size_b):
+    return (size_a * d_ak + size_b * d_bk) / float(size_a + size_b)
+
+
+def _complete(d_ak, d_bk, d_ab, size_a, size_b):
+    return max(d_ak, d_bk)
+
+
+def _single(d_ak, d_bk, d_ab, size_a, size_b):
+    return min(d_ak, d_bk)
+
+
+# Lance-Williams update of the distance between the merge of a and b and any other cluster k
+LANCE_WILLIAMS = {
+    'average': _average,
+    'complete': _complete,
+    'single': _single
+}
+
+
+class CondensedMatrix(object):
+    def __init__(self, rows, distance=pearson_distance, normalized_rows=None):
+        """
+        Upper triangle of the distance matrix between rows, stored row after row in one array
+        :param rows: data rows
+        :param distance: distance function
+        :param normalized_rows: rows from utilities.normalize_rows, Pearson distances are then computed in bulk
+        """
+        n = len(rows)
+        self.n = n
+        # offsets[i] + j is the position of the pair (i, j) for i < j
+        self.offsets = [i * n - i * (i + 1) // 2 - i - 1 for i in range(n)]
+        if normalized_rows is not None:
+            self.values = pairwise_pearson_distances(normalized_rows)
+            return
+        self.values = array('d', [0.0]) * (n * (n - 1) // 2)
+        for i in range(n):
+            offset = self.offsets[i]
+            for j in range(i + 1, n):
+                self.values[offset + j] = distance(rows[i], rows[j])
+
+    def get(self, i, j):
+        if i < j:
+            return self.values[self.offsets[i] + j]
+        return self.values[self.offsets[j] + i]
+
+    def set(self, i, j, value):
+        if i < j:
+            self.values[self.offsets[i] + j] = value
+        else:
+            self.values[self.offsets[j] + i] = value
+
+
+def _nearest_neighbour_chain(matrix, update, weights=None):
+    """
+    Merges of a reducible linkage, found with the nearest-neighbour chain algorithm
+    Each merged cluster takes over the slot of its lower branch in the matrix
+    :param matrix: CondensedMatrix, updated in place
+    :param update: Lance-Williams update
+    :param weights: optional starting size of every row
+    :return: list of (label a, label b, distance, new label)
+    """
+    n = matrix.n
+    active = list(range(n))
+    sizes = list(weights) if weights is not None else [1] * n
+    labels = list(range(n))
+    merges = []
+    chain = []
+    while len(active) > 1:
+        if not chain:
+            chain.append(active[0])
+        while True:
+            a = chain[-1]
+            # prefer the previous element of the chain on ties, so the chain always ends in a reciprocal pair
+            if len(chain) > 1:
+                best = chain[-2]
+                best_distance = matrix.get(a, best)
+            else:
+                best = None
+                best_distance = float('inf')
+            for k in active:
+                if k != a:
+                    d = matrix.get(a, k)
+                    if d < best_distance:
+                        best, best_distance = k, d
+            if len(chain) > 1 and best == chain[-2]:
+                break
+            chain.append(best)
+
+        a = chain.pop()
+        b = chain.pop()
+        if b < a:
+            a, b = b, a
+        for k in active:
+            if k != a and k != b:
+                matrix.set(a, k, update(matrix.get(a, k), matrix.get(b, k), best_distance, sizes[a], sizes[b]))
+        active.remove(b)
+        sizes[a] += sizes[b]
+        merges.append((min(labels[a], labels[b]), max(labels[a], labels[b]), best_distance, n + len(merges)))
+        labels[a] = n + len(merges) - 1
+    return merges
+
+
+def _centroid(rows, matrix, distance, normalized_rows=None):
+    """
+    Merges of centroid linkage: a new cluster gets the average vector of its branches and its distances to the
+    other clusters are computed from that vector, the rule of hierarchical_cluster.
+    Every cluster remembers its nearest neighbour, so a merge only rescans the clusters that pointed at it
+    :param rows: data rows
+    :param matrix: CondensedMatrix, updated in place
+    :param distance: distance function
+    :param normalized_rows: rows from utilities.normalize_rows to compute Pearson distances in bulk
+    :return: list of (label a, label b, distance, new label)
+    """
+    n = matrix.n
+    vectors = list(rows)
+    normalized = list(normalized_rows) if normalized_rows is not None else None
+    active = list(range(n))
+    labels = list(range(n))
+
+    def nearest(i):
+        best, best_distance = None, float('inf')
+        for k in active:
+            if k != i:
+                d = matrix.get(i, k)
+                if d < best_distance:
+                    best, best_distance = k, d
+        return best, best_distance
+
+    neighbours = [nearest(i) for i in range(n)]
+    merges = []
+    while len(active) > 1:
+        a = min(active, key=lambda i: (neighbours[i][1], labels[i]))
+        b, d = neighbours[a]
+        if b < a:
+            a, b = b, a
+        merges.append((min(labels[a], labels[b]), max(labels[a], labels[b]), d, n + len(merges)))
+
+        # the merged cluster takes over the slot of a
+        active.remove(b)
+        labels[a] = n + len(merges) - 1
+        # the data of a new cluster is the average of its 2 branches, as in hierarchical_cluster
+        vectors[a] = [(x + y) / 2.0 for x, y in zip(vectors[a], vectors[b])]
+        vectors[b] = None
+        others = [k for k in active if k != a]
+        if normalized is not None:
+            normalized[a] = normalize_row(vectors[a], normalized[a].typecode)
+            normalized[b] = None
+            new_distances = pearson_distances(normalized[a], [normalized[k] for k in others])
+        else:
+            new_distances = [distance(vectors[k], vectors[a]) for k in others]
+        for k, d_k in zip(others, new_distances):
+            matrix.set(a, k, d_k)
+        neighbours[a] = nearest(a)
+        for k in active:
+            if k == a:
+                continue
+            if neighbours[k][0] in (a, b):
+                neighbours[k] = nearest(k)
+            elif matrix.get(k, a) < neighbours[k][1]:
+                neighbours[k] = (a, matrix.get(k, a))
+    return merges
+
+
+def _merges(rows, distance, linkage, typecode, instrumentation, weights=None):
+    """
+    :return: list of (label a, label b, distance, new label) in merge order, see linkage_cluster
+    """
+    if linkage != 'centroid' and linkage not in LANCE_WILLIAMS:
+        raise ValueError('Unknown linkage {}'.format(linkage))
+    if weights is not None and linkage == 'centroid':
+        raise ValueError('Row weights need the average, complete or single linkage')
+    with instrumentation.timer('distance matrix'):
+        # Pearson distances go through the batched kernel of utilities
+        normalized_rows = normalize_rows(rows, typecode) if distance is pearson_distance else None
+        matrix = CondensedMatrix(rows, distance, normalized_rows)
+    instrumentation.count('pairs scored', len(matrix.values))
+    with instrumentation.timer('merges'):
+        if linkage == 'centroid':
+            merges = _centroid(rows, matrix, distance, normalized_rows)
+        else:
+            # the chain does not find merges in order of distance. A reducible linkage never merges below the
+            # distance of a branch, so a stable sort puts them in order without breaking any branch
+            merges = sorted(_nearest_neighbour_chain(matrix, LANCE_WILLIAMS[linkage], weights),
+                            key=lambda merge: merge[2])
+    instrumentation.count('merges', len(merges))
+    return merges
+
+
+def linkage_cluster(rows, distance=pearson_distance, linkage='average', typecode='d', instrumentation=None,
+                    weights=None):
+    """
+    Create Hierarchical Cluster groups from a distance matrix computed once
+    The result is the same kind of BiCluster tree as hierarchical_cluster, ready for draw_dendogram and
+    print_clusters
+    :param rows: data rows
+    :param distance: distance function
+    :param linkage: distance between 2 clusters
+        'average': mean distance between their rows
+        'complete': largest distance between their rows
+        'single': smallest distance between their rows
+        'centroid': distance between the average vectors, the rule of hierarchical_cluster
+    :param typecode: 'd' or 'f' (float32) storage of the normalized rows, when distance is pearson_distance
+    :param instrumentation: optional Instrumentation, times the 'distance matrix', 'merges' and 'tree' stages and
+        counts 'pairs scored' and 'merges'
+    :param weights: optional number of rows each row stands for, e.g. the sizes of BIRCH entries. Average linkage
+        then weights every row by it, complete and single linkage do not depend on sizes, centroid does not
+        support weights
+    :return: root BiCluster
+    """
+    instrumentation = instrumentation or SILENT
+    merges = _merges(rows, distance, linkage, typecode, instrumentation, weights)
+    with instrumentation.timer('tree'):
+        return LinkageMatrix.from_merges(len(rows), merges).to_bicluster(rows)
+
+
+def linkage_matrix(rows, distance=pearson_distance, linkage='average', typecode='d', instrumentation=None,
+                   keep_centroids=False, weights=None):
+    """
+    Same clustering as linkage_cluster, returned as a compact LinkageMatrix instead of a BiCluster tree
+    :param keep_centroids: store the average vector of every merged cluster
+    :return: LinkageMatrix, see linkage_cluster for the other parameters
+    """
+    instrumentation = instrumentation or SILENT
+    merges = _merges(rows, distance, linkage, typecode, instrumentation, weights)
+    with instrumentation.timer('tree'):
+        return LinkageMatrix.from_merges(len(rows), merges, rows if keep_centroids else None)
@@ -0,0 +1,162 @@
+from array import array
+
+from cluster import BiCluster
+from tree_utilities import iter_postorder
+
+"""
+Compact result of hierarchical clustering
+A BiCluster tree keeps a merged vector in every branch, about 2n dense vectors for n rows. A LinkageMatrix keeps
+4 flat arrays of n - 1 numbers instead, one entry per merge in the order the merges happened:
+    left, right     the 2 clusters merged. Rows are 0 .. n-1, the cluster made by merge m is n + m
+    distance        distance of the merge
+    size            number of rows under the new cluster
+Average vectors of the merged clusters are only kept when asked for
+"""
+
+
+class LinkageMatrix(object):
+    __slots__ = ('n', 'left', 'right', 'distance', 'size', 'centroids')
+
+    def __init__(self, n, left, right, distance, size, centroids=None):
+        """
+        :param n: number of rows
+        :param left: array('i') of n - 1 cluster numbers
+        :param right: array('i') of n - 1 cluster numbers
+        :param distance: array('d') of n - 1 merge distances
+        :param size: array('i') of n - 1 cluster sizes
+        :param centroids: optional list of n - 1 array('d'), the average vector of every merged cluster
+        """
+        self.n = n
+        self.left = left
+        self.right = right
+        self.distance = distance
+        self.size = size
+        self.centroids = centroids
+
+    @classmethod
+    def from_merges(cls, n, merges, rows=None):
+        """
+        :param n: number of rows
+        :param merges: list of (label a, label b, distance, new label) in the order they happened, as produced by
+            linkage_clustering. Rows are labelled 0 .. n-1 and new labels are n or more in any order
+        :param rows: optional data rows, to store the average vector of every merged cluster like BiCluster does
+        :return: LinkageMatrix
+        """
+        left, right, size = array('i'), array('i'), array('i')
+        distances = array('d')
+        centroids = [] if rows is not None else None
+        number = {}
+        for m, (a, b, d, label) in enumerate(merges):
+            a, b = number.get(a, a), number.get(b, b)
+            number[label] = n + m
+            left.append(a)
+            right.append(b)
+            distances.append(d)
+            size.append((size[a - n] if a >= n else 1) + (size[b - n] if b >= n else 1))
+            if centroids is not None:
+                vector_a = centroids[a - n] if a >= n else rows[a]
+                vector_b = centroids[b - n] if b >= n else rows[b]
+                # the data of a new cluster is the average of its 2 branches, as in hierarchical_cluster
+                centroids.append(array('d', [(x + y) / 2.0 for x, y in zip(vector_a, vector_b)]))
+        return cls(n, left, right, distances, size, centroids)
+
+    @classmethod
+    def from_bicluster(cls, root, keep_centroids=False):
+        """
+        :param root: BiCluster tree whose leaves have the ids 0 .. n-1
+        :param keep_centroids: store the vec of every branch
+        :return: LinkageMatrix, merges are numbered children first, in the order of the branch ids -1, -2, ...
+            when the tree comes from hierarchical_cluster or linkage_cluster
+        """
+        branches = [node for node in iter_postorder(root) if node.left is not None or node.right is not None]
+        # ids of branches are -1, -2, ... in merge order, any other tree keeps its post-order
+        if all(node.id is not None and node.id < 0 for node in branches):
+            branches.sort(key=lambda node: -node.id)
+        n = len(branches) + 1
+        number = {}
+        merges = []
+        for m, node in enumerate(branches):
+            number[id(node)] = n + m
+            a = number.get(id(node.left), node.left.id)
+            b = number.get(id(node.right), node.right.id)
+            merges.append((a, b, node.distance, n + m))
+        matrix = cls.from_merges(n, merges)
+        if keep_centroids:
+            matrix.centroids = [array('d', node.vec) for node in branches]
+        return matrix
+
+    def to_bicluster(self, rows=None):
+        """
+        :param rows: optional data rows. The vec of a leaf is its row, the vec of a branch its stored centroid, or
+            the average of its 2 branches when rows are given and centroids are not stored, None otherwise
+        :return: root BiCluster, leaves have the ids of their rows and branches -1, -2, ... in merge order
+        """
+        n = self.n
+        nodes = [BiCluster(rows[i] if rows is not None else None, id=i) for i in range(n)]
+        for m in range(n - 1):
+            left, right = nodes[self.left[m]], nodes[self.right[m]]
+            if self.centroids is not None:
+                vec = list(self.centroids[m])
+            elif left.vec is not None and right.vec is not None:
+                vec = [(x + y) / 2.0 for x, y in zip(left.vec, right.vec)]
+            else:
+                vec = None
+            nodes.append(BiCluster(vec, left=left, right=right, distance=self.distance[m], id=-1 - m))
+        return nodes[-1]
+
+    def __len__(self):
+        return len(self.distance)
+
+    def merge(self, m):
+        """
+        :return: tuple of (left, right, distance, size) of merge m
+        """
+        return self.left[m], self.right[m], self.distance[m], self.size[m]
+
+    def _flat(self, merges):
+        # union-find over the first merges, every row ends with the number of its flat cluster
+        n = self.n
+        parent = list(range(2 * n - 1))
+
+        def find(i):
+            root = i
+            while parent[root] != root:
+                root = parent[root]
+            while parent[i] != root:
+                parent[i], i = root, parent[i]
+            return root
+
+        for m in merges:
+            parent[find(self.left[m])] = n + m
+            parent[find(self.right[m])] = n + m
+        numbers = {}
+        labels = []
+        for i in range(n):
+            root = find(i)
+            if root not in numbers:
+                numbers[root] = len(numbers)
+            labels.append(numbers[root])
+        return labels
+
+    def cut(self, threshold=None, clusters=None):
+        """
+        Flat clusters, in about O(n)
+        :param threshold: cut the tree top down, a cluster whose merge distance is at most threshold is kept whole.
+            Centroid linkage has inversions, merges below a kept merge are then kept even when their distance is
+            larger than threshold
+        :param clusters: number of clusters, keep the first n - clusters merges
+        :return: list with the cluster number of every row, clusters are numbered in order of their first row
+        """
+        if (threshold is None) == (clusters is None):
+            raise ValueError('Give either threshold or clusters')
+        if clusters is not None:
+            return self._flat(range(max(0, self.n - max(clusters, 1))))
+        n = self.n
+        kept = [d <= threshold for d in self.distance]
+        # a merge always comes after the merges of its branches, walking backwards visits parents first
+        for m in range(len(kept) - 1, -1, -1):
+            if kept[m]:
+                for branch in (self.left[m], self.right[m]):
+                    if branch >= n:
+                        kept[branch - n] = True
+        return self._flat([m for m in range(len(kept)) if kept[m]])
@@ -1,13 +1,257 @@
+from itertools import imap
 from math import sqrt
+from operator import mul
+from random import Random
+import time
 
 from PIL import Image
 from PIL import ImageDraw
 
-from utilities import pearson_distance
-from random import random
+from instrumentation import SILENT
+from utilities import pearson_distance, normalize_rows, pairwise_pearson_distances
 
+"""
+Multidimensional scaling
+Target distances are kept in a condensed array of the upper triangle, like linkage_clustering, and the gradient
+visits every pair once and updates both of its points. Starting points come from classical MDS, the 2 leading
+eigenvectors of the double centred squared distance matrix, so the descent starts next to a good layout.
+For large inputs the stochastic mode samples a few partners per point and step, and classical MDS runs on a set
+of landmarks only, so neither the n x n distances nor the n x n gradient terms are ever computed
+"""
 
-def scale_down(data, distance=pearson_distance, rate=0.01):
+
+def _offsets(n):
+    # offsets[i] + j is the position of the pair (i, j) for i < j in a condensed array
+    return [i * n - i * (i + 1) // 2 - i - 1 for i in range(n)]
+
+
+def _target_distances(data, distance):
+    """
+    :return: condensed array of the real distances between all pairs of rows
+    """
+    if distance is pearson_distance:
+        return pairwise_pearson_distances(normalize_rows(data))
+    return [distance(data[i], data[j]) for i in range(len(data)) for j in range(i + 1, len(data))]
+
+
+def _pair_distance(data, distance):
+    """
+    :return: function (i, j) -> real distance between rows i and j, computed on demand
+    """
+    if distance is pearson_distance:
+        normalized_rows = normalize_rows(data)
+        return lambda i, j: 1.0 - sum(imap(mul, normalized_rows[i], normalized_rows[j]))
+    return lambda i, j: distance(data[i], data[j])
+
+
+def _cached_pair_distance(pair_distance, n, size=1 << 18):
+    """
+    Remember the distances pair_distance computes, the stochastic steps sample the same pairs again and again
+    :param size: at most that many distances are kept, later pairs are computed every time they come up
+    :return: function (i, j) -> real distance between rows i and j
+    """
+    cache = {}
+
+    def cached(i, j):
+        key = i * n + j if i < j else j * n + i
+        value = cache.get(key)
+        if value is None:
+            value = pair_distance(i, j)
+            if len(cache) < size:
+                cache[key] = value
+        return value
+    return cached
+
+
+def _leading_eigenvectors(multiply, n, rng, dimensions=2, iterations=100, tolerance=1e-9):
+    """
+    Power iteration with deflation on a symmetric matrix given by its product with a vector
+    :param multiply: function vector -> matrix . vector
+    :return: list of (eigenvalue, unit eigenvector), largest eigenvalue first
+    """
+    found = []
+
+    def deflated(v):
+        result = multiply(v)
+        for value, vector in found:
+            dot = sum(imap(mul, vector, v))
+            result = [r - value * dot * e for r, e in zip(result, vector)]
+        return result
+
+    for d in range(dimensions):
+        shift = 0.0
+        for attempt in range(2):
+            v = [rng.random() - 0.5 for i in range(n)]
+            value = 0.0
+            for t in range(iterations):
+                w = [a + shift * b for a, b in zip(deflated(v), v)]
+                norm = sqrt(sum(imap(mul, w, w)))
+                if norm == 0:
+                    break
+                w = [a / norm for a in w]
+                value = sum(imap(mul, w, [a + shift * b for a, b in zip(deflated(w), w)])) - shift
+                converged = sum([(a - b) ** 2 for a, b in zip(w, v)]) < tolerance
+                v = w
+                if converged:
+                    break
+            # power iteration finds the largest eigenvalue in absolute value, shift once to reach the largest one
+            if value >= 0 or shift:
+                break
+            shift = -value
+        found.append((value, v))
+    return found
+
+
+def _double_centred_product(squares, n):
+    """
+    Product of B = -1/2 J D2 J with a vector, without building B
+    :param squares: condensed array of squared distances
+    :param n: number of points
+    :return: function vector -> B . vector
+    """
+    offsets = _offsets(n)
+    row_means = [0.0] * n
+    for i in range(n):
+        for j in range(i + 1, n):
+            s = squares[offsets[i] + j]
+            row_means[i] += s
+            row_means[j] += s
+    row_means = [r / n for r in row_means]
+    grand_mean = sum(row_means) / n
+
+    def multiply(v):
+        result = [0.0] * n
+        for i in range(n):
+            vi = v[i]
+            offset = offsets[i]
+            for j in range(i + 1, n):
+                s = squares[offset + j]
+                result[i] += s * v[j]
+                result[j] += s * vi
+        total = sum(v)
+        row_dot = sum(imap(mul, row_means, v))
+        return [-0.5 * (result[i] - row_means[i] * total - row_dot + grand_mean * total) for i in range(n)]
+    return multiply
+
+
+def classical_scaling(targets, n, rng=None):
+    """
+    Classical MDS (Torgerson): coordinates from the 2 leading eigenvectors of the double centred squared distances
+    :param targets: condensed array of distances
+    :param n: number of points
+    :param rng: random.Random instance for the power iteration
+    :return: list of [x, y] locations
+    """
+    rng = rng or Random(0)
+    if n < 3:
+        return [[0.0, float(i)] for i in range(n)]
+    squares = [d * d for d in targets]
+    axes = [[e * sqrt(max(value, 0.0)) for e in vector]
+            for value, vector in _leading_eigenvectors(_double_centred_product(squares, n), n, rng)]
+    return [[axes[0][i], axes[1][i]] for i in range(n)]
+
+
+def landmark_scaling(n, pair_distance, landmarks=256, rng=None):
+    """
+    Landmark MDS (de Silva and Tenenbaum): classical MDS on a random set of landmarks, then every other point is
+    placed from its distances to the landmarks. Needs n * landmarks distances instead of n * n
+    :param n: number of points
+    :param pair_distance: function (i, j) -> real distance
+    :param landmarks: number of landmarks
+    :param rng: random.Random instance
+    :return: list of [x, y] locations
+    """
+    rng = rng or Random(0)
+    chosen = sorted(rng.sample(range(n), min(landmarks, n)))
+    size = len(chosen)
+    if size < 3:
+        return [[0.0, float(i)] for i in range(n)]
+    targets = [pair_distance(chosen[a], chosen[b]) for a in range(size) for b in range(a + 1, size)]
+    squares = [d * d for d in targets]
+    eigen = _leading_eigenvectors(_double_centred_product(squares, size), size, rng)
+
+    # mean squared distance of every landmark to the other landmarks
+    offsets = _offsets(size)
+    mean_squares = [0.0] * size
+    for a in range(size):
+        for b in range(a + 1, size):
+            mean_squares[a] += squares[offsets[a] + b]
+            mean_squares[b] += squares[offsets[a] + b]
+    mean_squares = [m / size for m in mean_squares]
+    # pseudo-inverse transpose of the landmark coordinates
+    projections = [[e / sqrt(value) if value > 0 else 0.0 for e in vector] for value, vector in eigen]
+
+    locations = []
+    for i in range(n):
+        deltas = [pair_distance(i, landmark) ** 2 - mean for landmark, mean in zip(chosen, mean_squares)]
+        locations.append([-0.5 * sum(imap(mul, projection, deltas)) for projection in projections])
+    return locations
+
+
+def _full_step(xs, ys, targets, n):
+    """
+    Gradient of the error over all pairs, each pair is visited once
+    :return: tuple of gradient x, gradient y, total error
+    """
+    gx = [0.0] * n
+    gy = [0.0] * n
+    total_error = 0.0
+    offsets = _offsets(n)
+    for i in range(n - 1):
+        xi, yi = xs[i], ys[i]
+        offset = offsets[i]
+        for j in range(i + 1, n):
+            dx = xi - xs[j]
+            dy = yi - ys[j]
+            fake = sqrt(dx * dx + dy * dy)
+            real = targets[offset + j]
+            # coinciding points have no direction and identical rows no relative error, they are left alone
+            if fake == 0 or real == 0:
+                continue
+            # The error is percent difference between the distances
+            error_term = (fake - real) / real
+            # the pair counts once for each of its 2 points
+            total_error += 2 * abs(error_term)
+            f = error_term / fake
+            gx[i] += dx * f
+            gy[i] += dy * f
+            gx[j] -= dx * f
+            gy[j] -= dy * f
+    return gx, gy, total_error
+
+
+def _stochastic_step(xs, ys, pair_distance, n, pairs, rng):
+    """
+    Estimate of the gradient from pairs random partners per point, scaled to the size of the full gradient
+    :return: tuple of gradient x, gradient y, estimated total error
+    """
+    gx = [0.0] * n
+    gy = [0.0] * n
+    total_error = 0.0
+    scale = (n - 1) / float(pairs)
+    for i in range(n):
+        xi, yi = xs[i], ys[i]
+        for p in range(pairs):
+            j = rng.randrange(n - 1)
+            if j >= i:
+                j += 1
+            dx = xi - xs[j]
+            dy = yi - ys[j]
+            fake = sqrt(dx * dx + dy * dy)
+            real = pair_distance(i, j)
+            if fake == 0 or real == 0:
+                continue
+            error_term = (fake - real) / real
+            total_error += abs(error_term) * scale
+            f = error_term / fake * scale
+            gx[i] += dx * f
+            gy[i] += dy * f
+    return gx, gy, total_error
+
+
+def scale_down(data, distance=pearson_distance, rate=0.01, init='classical', pairs=None, landmarks=256,
+               iterations=1000, seed=None, tolerance=1e-5, adaptive=True, patience=50, max_time=None, callback=None,
+               instrumentation=None):
     """
     Take the data vector and return an array with 2 columns for the X,Y coordinates of the items on the
     two-dimensional chart.
@@ -20,60 +264,124 @@ def scale_down(data, distance=pearson_distance, rate=0.01):
     This procedure is repeated many times until the total amount of error cannot be reduced any more.
     :param data: Input data
     :param distance: Distance function, Default: Pearson distance
-    :param rate:
-    :return:
+    :param rate: learning rate
+    :param init: 'classical' starts from classical MDS, 'random' from random points in the unit square
+    :param pairs: None uses every pair in every step. A number switches to the stochastic mode: every point is
+        moved by pairs random partners per step and classical MDS uses landmarks, for thousands of items
+    :param landmarks: number of landmarks of the stochastic mode
+    :param iterations: maximum number of steps
+    :param seed: seed of the random generator, or a random.Random instance
+    :param tolerance: stop once a step lowers the error by less than this fraction of it
+    :param adaptive: bold driver step size. A step that lowers the error makes the rate 5% larger, a step that
+        raises it is undone and the rate is halved (reduced by 20% in the stochastic mode, where nothing is undone).
+        False keeps rate fixed and stops at the first raise
+    :param patience: the stochastic mode stops after that many steps without lowering its smoothed error by more
+        than tolerance, the noise of the estimate keeps the single step test above from firing
+    :param max_time: optional budget in seconds including the start layout, the best layout so far is returned
+        when it runs out
+    :param callback: optional function (iteration, stress, rate) called after every step, stress is the total
+        error. Returning True stops the descent
+    :param instrumentation: optional Instrumentation, times the 'targets', 'start layout' and 'descent' stages,
+        counts 'iterations' and reports 'iteration' progress with the error and the rate
+    :return: list of [x, y] locations, one per row of data
     """
+    instrumentation = instrumentation or SILENT
+    started = time.time()
     n = len(data)
+    rng = seed if isinstance(seed, Random) else Random(seed)
+    with instrumentation.timer('targets'):
+        if pairs is None:
+            targets = _target_distances(data, distance)
+            pair_distance = None
+        else:
+            targets = None
+            pair_distance = _pair_distance(data, distance)
+            pairs = min(pairs, n - 1)
 
-    # The real dimensions between every pair of items
-    # here we convert data to 2D data
-    read_list = [[distance(data[i], data[j]) for j in range(n)] for i in range(0, n)]
+    with instrumentation.timer('start layout'):
+        if init == 'random':
+            locations = [[rng.random(), rng.random()] for i in range(n)]
+        elif init == 'classical':
+            if pairs is None:
+                locations = classical_scaling(targets, n, rng)
+            else:
+                locations = landmark_scaling(n, pair_distance, landmarks, rng)
+        else:
+            raise ValueError('Unknown init {}'.format(init))
+    if n < 2:
+        return locations
+    xs = [location[0] for location in locations]
+    ys = [location[1] for location in locations]
+    if pair_distance is not None:
+        pair_distance = _cached_pair_distance(pair_distance, n)
 
-    # now we need to scale 2D data to show in image
-    outersum = 0.0
+    last_error = None
+    # last layout that lowered the error, with its gradient, to step back to in the full mode
+    accepted = None
+    # the stochastic error is only an estimate, decisions are taken on its moving average
+    smoothed = None
+    # lowest smoothed error so far and the number of steps since it was reached
+    best = None
+    stalled = 0
+    descent_started = time.time()
+    for m in range(iterations):
+        if pairs is None:
+            gx, gy, total_error = _full_step(xs, ys, targets, n)
+            current = total_error
+        else:
+            gx, gy, total_error = _stochastic_step(xs, ys, pair_distance, n, pairs, rng)
+            smoothed = total_error if smoothed is None else 0.9 * smoothed + 0.1 * total_error
+            current = smoothed
+            if best is None or current < best - tolerance * best:
+                best = current
+                stalled = 0
+            else:
+                stalled += 1
+        instrumentation.count('iterations')
+        instrumentation.report('iteration', m + 1, iterations, error=total_error, rate=rate)
+        if callback is not None and callback(m, total_error, rate):
+            break
 
-    # Randomly initialize the starting points of the locations in 2D
-    locations = [[random(), random()] for i in range(n)]
-    fake_distance = [[0.0 for j in range(n)] for i in range(n)]
+        if last_error is not None and current > last_error:
+            # the answer got worse by moving the points
+            if not adaptive:
+                break
+            if pairs is None:
+                # go back to the last accepted layout and retry with a smaller step
+                rate *= 0.5
+                xs, ys, gx, gy = list(accepted[0]), list(accepted[1]), accepted[2], accepted[3]
+                if rate < 1e-12:
+                    break
+            else:
+                # noise raises the estimate now and then, the step shrinks slower and nothing is undone
+                rate *= 0.8
+                last_error = current
+                if rate < 1e-12:
+                    break
+        else:
+            if last_error is not None and last_error - current <= tolerance * last_error:
+                break
+            if adaptive and last_error is not None:
+                rate *= 1.05
+            last_error = current
+            if pairs is None:
+                accepted = (list(xs), list(ys), gx, gy)
 
-    last_error = None
-    for m in range(0, 1000):
-        # Find projected distances
-        for i in range(n):
-            for j in range(n):
-                fake_distance[i][j] = sqrt(
-                    sum([pow(locations[i][x] - locations[j][x], 2) for x in range(len(locations[i]))]))
-        # Move points
-        gradient = [[0.0, 0.0] for i in range(n)]
+        if stalled >= patience:
+            break
 
-        total_error = 0
-        for k in range(n):
-            for j in range(n):
-                if j == k:
-                    continue
-                # The error is percent difference between the distances
-                error_term = (fake_distance[j][k] - read_list[j][k]) / read_list[j][k]
-
-                # Each point needs to be moved away from or towards the other
-                # point in proportion to how much error it has
-                gradient[k][0] += ((locations[k][0] - locations[j][0]) / fake_distance[j][k]) * error_term
-                gradient[k][1] += ((locations[k][1] - locations[j][1]) / fake_distance[j][k]) * error_term
-
-                # Keep track of the total error
-                total_error += abs(error_term)
-        print 'Total Error: {}'.format(total_error)
-
-        # if the answer got worse by moving the points, we are done
-        if last_error and last_error < total_error:
+        if max_time is not None and time.time() - started >= max_time:
+            if accepted is not None:
+                xs, ys = accepted[0], accepted[1]
             break
-        last_error = total_error
 
         # Move each of the points by the learning rate times the gradient
         for k in range(n):
-            locations[k][0] -= rate * gradient[k][0]
-            locations[k][1] -= rate * gradient[k][1]
+            xs[k] -= rate * gx[k]
+            ys[k] -= rate * gy[k]
 
-    return locations
+    instrumentation.add_time('descent', time.time() - descent_started)
+    return [[x, y] for x, y in zip(xs, ys)]
 
 
 def draw2d(data, labels, image_name='mds2d.jpg'):
@@ -84,11 +392,18 @@ def draw2d(data, labels, image_name='mds2d.jpg'):
     :param image_name: 'mds2d.jpg' as default
     :return: None, save image file
     """
-    img = Image.new('RGB', (2000, 2000), (255, 255, 255))
+    size, margin, label_room = 2000, 50, 300
+    img = Image.new('RGB', (size, size), (255, 255, 255))
     draw = ImageDraw.Draw(img)
+    # fit the bounding box of the layout to the canvas, keeping its aspect. The classical start is centred on the
+    # origin and a random start is not, labels are written to the right of their point
+    min_x = min([point[0] for point in data] or [0.0])
+    min_y = min([point[1] for point in data] or [0.0])
+    span = max([max(point[0] - min_x, point[1] - min_y) for point in data] or [0.0]) or 1.0
+    scale = (size - 2 * margin - label_room) / span
     for i in range(len(data)):
-        x = (data[i][0] + 0.5) * 1000
-        y = (data[i][1] + 0.5) * 1000
+        x = margin + (data[i][0] - min_x) * scale
+        y = margin + (data[i][1] - min_y) * scale
 
         draw.text((x, y), labels[i], (0, 0, 0))
         # (x1,y1) = draw.textsize(labels[i])
@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import time
+from random import Random
+
+from fast_k_means import fast_k_means
+from utilities import pearson_distance
+
+"""
+Multi-restart k-means on a process pool
+Every restart is an independently seeded fast_k_means run. k-means only finds a local optimum, so the run with the
+lowest total distance between the rows and their centroids is kept. Restarts do not share any state, with as many
+processes as restarts they all run at the same time
+"""
+
+# Read-only state of the running restarts. It is filled in before the pool is created, so forked workers
+# share the rows copy-on-write instead of receiving a pickled copy with every job
+_shared = {}
+
+
+def _init_worker(rows, distance, k, options):
+    # Platforms without fork start fresh interpreters, they get the rows once per worker
+    _shared['rows'] = rows
+    _shared['distance'] = distance
+    _shared['k'] = k
+    _shared['options'] = options
+
+
+def _run(job):
+    """
+    One restart
+    :param job: tuple of (run number, seed)
+    :return: tuple of (statistics dictionary, best_matches, distances_from_centroids)
+    """
+    run, seed = job
+    stats = {}
+    start = time.time()
+    best_matches, distances_from_centroids = fast_k_means(_shared['rows'], _shared['distance'], _shared['k'],
+                                                          seed=seed, stats=stats, **_shared['options'])
+    stats.update(run=run, seed=seed, seconds=time.time() - start,
+                 total_distance=sum(distances_from_centroids.values()),
+                 sizes=[len(members) for members in best_matches])
+    return stats, best_matches, distances_from_centroids
+
+
+def restart_k_means(rows, distance=pearson_distance, k=4, restarts=16, seed=None, processes=None, **options):
+    """
+    Run k-means restarts times and keep the best run
+    :param rows: Data
+    :param distance: Distance Function
+    :param k: how many clusters do you want to make
+    :param restarts: number of independently seeded runs
+    :param seed: seed of the generator that draws the seed of every run, same seed gives the same result whatever
+        the number of processes
+    :param processes: size of the pool, default is the number of cores. 1 runs the restarts in this process
+    :param options: passed on to fast_k_means, e.g. max_iterations or batch_size
+    :return: tuple of best_matches and distances_from_centroids of the run with the lowest total distance, then the
+        list of per run statistics in run order: run, seed, total_distance, sizes, seconds, iterations, distances,
+        pruned
+    """
+    rng = Random(seed)
+    jobs = [(run, rng.randrange(1 << 31)) for run in range(restarts)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, restarts))
+
+    _init_worker(rows, distance, k, options)
+    try:
+        if processes == 1:
+            results = [_run(job) for job in jobs]
+        else:
+            if hasattr(os, 'fork'):
+                pool = multiprocessing.Pool(processes)
+            else:
+                pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(rows, distance, k, options))
+            try:
+                # one job at a time per worker, restarts can differ a lot in number of iterations
+                results = pool.map(_run, jobs, chunksize=1)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        _shared.clear()
+
+    # lowest total distance wins, the earlier run on ties
+    stats, best_matches, distances_from_centroids = min(results, key=lambda result: (result[0]['total_distance'],
+                                                                                     result[0]['run']))
+    return best_matches, distances_from_centroids, [result[0] for result in results]
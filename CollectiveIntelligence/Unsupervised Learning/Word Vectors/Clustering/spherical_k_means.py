@@ -0,0 +1,189 @@
+from array import array
+from itertools import imap
+from math import log, sqrt
+from operator import mul
+from random import Random
+
+from instrumentation import SILENT
+
+"""
+Spherical k-means on sparse word count rows
+Rows are TF-IDF weighted and scaled to unit length, centroids are unit length too, so the cosine similarity of a
+row and a centroid is their dot product. A row only stores its non zero words, as an array of column indices and
+an array of weights, and its product with a dense centroid only reads the centroid at those columns. A pass costs
+non zeros x k instead of rows x vocabulary x k, which is what makes 100k word vocabularies workable.
+Rows come from clusters.read_sparse_file or clusters.iter_sparse_rows
+"""
+
+
+def document_frequencies(rows):
+    """
+    :param rows: iterable of {column index: count}
+    :return: tuple of number of rows and dictionary of column index -> number of rows that use it
+    """
+    n = 0
+    frequencies = {}
+    for row in rows:
+        n += 1
+        for column, count in row.items():
+            if count:
+                frequencies[column] = frequencies.get(column, 0) + 1
+    return n, frequencies
+
+
+def inverse_document_frequencies(rows):
+    """
+    :param rows: list of {column index: count}
+    :return: dictionary of column index -> log(rows / rows using the column)
+    """
+    n, frequencies = document_frequencies(rows)
+    return dict((column, log(float(n) / df)) for column, df in frequencies.items())
+
+
+def weight_row(row, idf=None):
+    """
+    :param row: {column index: count}
+    :param idf: optional result of inverse_document_frequencies, None keeps raw counts
+    :return: tuple of array of column indices and array of weights, scaled to unit length
+    """
+    columns = sorted(column for column, count in row.items() if count)
+    if idf is None:
+        weights = [float(row[column]) for column in columns]
+    else:
+        weights = [row[column] * idf.get(column, 0.0) for column in columns]
+    # words used by every row have an idf of 0 and carry no information
+    kept = [(column, weight) for column, weight in zip(columns, weights) if weight]
+    norm = sqrt(sum(weight * weight for column, weight in kept))
+    if norm == 0:
+        return array('i'), array('d')
+    return array('i', [column for column, weight in kept]), array('d', [weight / norm for column, weight in kept])
+
+
+def weight_rows(rows, tf_idf=True):
+    """
+    :param rows: list of {column index: count}
+    :param tf_idf: weight counts by inverse document frequency
+    :return: list of (indices, weights), see weight_row
+    """
+    idf = inverse_document_frequencies(rows) if tf_idf else None
+    return [weight_row(row, idf) for row in rows]
+
+
+def sparse_dot(indices, weights, dense):
+    return sum(imap(mul, weights, imap(dense.__getitem__, indices)))
+
+
+def _similarities(row, centroids):
+    indices, weights = row
+    return [sparse_dot(indices, weights, centroid) for centroid in centroids]
+
+
+def _unit(dense):
+    norm = sqrt(sum(imap(mul, dense, dense)))
+    if norm == 0:
+        return dense
+    return array('d', [v / norm for v in dense])
+
+
+def _dense(row, columns):
+    dense = array('d', [0.0]) * columns
+    for column, weight in zip(*row):
+        dense[column] = weight
+    return dense
+
+
+def _seed(rows, k, columns, rng):
+    """
+    k-means++ on cosine distance: every next seed is a row drawn with probability proportional to its distance
+    from the closest seed picked so far
+    :return: list of k dense unit centroids
+    """
+    first = rng.randrange(len(rows))
+    centroids = [_dense(rows[first], columns)]
+    chosen = set([first])
+    closest = [1.0 - sparse_dot(indices, weights, centroids[0]) for indices, weights in rows]
+    while len(centroids) < k:
+        total = sum(max(d, 0.0) for d in closest)
+        if total <= 0:
+            pick = rng.choice([i for i in range(len(rows)) if i not in chosen])
+        else:
+            target = rng.random() * total
+            cumulative = 0.0
+            pick = None
+            for i, d in enumerate(closest):
+                if d > 0:
+                    pick = i
+                    cumulative += d
+                    if cumulative >= target:
+                        break
+        chosen.add(pick)
+        centroids.append(_dense(rows[pick], columns))
+        new = centroids[-1]
+        closest = [min(d, 1.0 - sparse_dot(indices, weights, new)) for d, (indices, weights) in zip(closest, rows)]
+    return centroids
+
+
+def spherical_k_means(rows, columns=None, k=4, seed=None, max_iterations=100, tf_idf=True, instrumentation=None):
+    """
+    k-means clustering of sparse word count rows by cosine similarity
+    :param rows: list of {column index: count}, the rows of clusters.read_sparse_file
+    :param columns: size of the vocabulary, default is the largest column index + 1
+    :param k: how many clusters do you want to make
+    :param seed: seed of the random generator, or a random.Random instance
+    :param max_iterations: maximum number of passes
+    :param tf_idf: weight counts by inverse document frequency, False uses raw counts
+    :param instrumentation: optional Instrumentation, counts 'iterations' and 'products' of a row with a centroid,
+        reports 'iteration' progress with the number of rows that changed cluster and the total similarity
+    :return: tuple of best_matches, the list of row indices of every cluster, and distances_from_centroids,
+        the dictionary of row index -> 1 - cosine similarity to its centroid, as k_means_clustering
+    """
+    if k > len(rows):
+        raise ValueError('Cannot make {} clusters out of {} rows'.format(k, len(rows)))
+    instrumentation = instrumentation or SILENT
+    rng = seed if isinstance(seed, Random) else Random(seed)
+    if columns is None:
+        columns = max([max(row) for row in rows if row] or [-1]) + 1
+
+    with instrumentation.timer('weighting'):
+        weighted = weight_rows(rows, tf_idf)
+    with instrumentation.timer('seeding'):
+        centroids = _seed(weighted, k, columns, rng)
+
+    assignment = None
+    similarities = None
+    for t in range(max_iterations):
+        with instrumentation.timer('assignment'):
+            new_assignment = []
+            similarities = []
+            for row in weighted:
+                scores = _similarities(row, centroids)
+                best = scores.index(max(scores))
+                new_assignment.append(best)
+                similarities.append(scores[best])
+        instrumentation.count('iterations')
+        instrumentation.count('products', k * len(weighted))
+        moved = len(weighted) if assignment is None else sum(a != b for a, b in zip(assignment, new_assignment))
+        instrumentation.report('iteration', t + 1, max_iterations, moved=moved, similarity=sum(similarities))
+        if moved == 0:
+            break
+        assignment = new_assignment
+
+        # Move every centroid to the direction of the sum of its rows, empty clusters keep their centroid
+        with instrumentation.timer('update'):
+            sums = [None] * k
+            for (indices, weights), i in zip(weighted, assignment):
+                if sums[i] is None:
+                    sums[i] = array('d', [0.0]) * columns
+                total = sums[i]
+                for column, weight in zip(indices, weights):
+                    total[column] += weight
+            for i in range(k):
+                if sums[i] is not None:
+                    centroids[i] = _unit(sums[i])
+
+    best_matches = [[] for i in range(k)]
+    distances_from_centroids = {}
+    for j, i in enumerate(assignment):
+        best_matches[i].append(j)
+        distances_from_centroids[j] = 1.0 - similarities[j]
+    return best_matches, distances_from_centroids
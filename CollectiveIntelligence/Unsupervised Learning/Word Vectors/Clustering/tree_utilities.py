@@ -0,0 +1,94 @@
+"""
+Iterative walks over BiCluster trees
+Trees built from thousands of rows are deep and unbalanced, recursive walks hit the recursion limit of Python.
+Every walk here keeps its own stack instead. Height (number of leaves) and depth (largest total distance down to a
+leaf) are computed once per node in one post-order pass and cached on the nodes, a tree is never changed after
+it is built
+"""
+
+
+def is_leaf(cluster):
+    return cluster.left is None and cluster.right is None
+
+
+def children(cluster):
+    return [child for child in (cluster.left, cluster.right) if child is not None]
+
+
+def iter_preorder(root):
+    """
+    Walk the tree parents first, left branch before right branch
+    :param root: BiCluster
+    :return: generator of (node, level), level of root is 0
+    """
+    stack = [(root, 0)]
+    while stack:
+        node, level = stack.pop()
+        yield node, level
+        # right is pushed first so left comes out first
+        for child in reversed(children(node)):
+            stack.append((child, level + 1))
+
+
+def iter_postorder(root):
+    """
+    Walk the tree children first
+    :param root: BiCluster
+    :return: generator of nodes, every node comes after both of its branches
+    """
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+            continue
+        stack.append((node, True))
+        for child in reversed(children(node)):
+            stack.append((child, False))
+
+
+def annotate(root):
+    """
+    Cache height and depth on every node of the tree that does not have them yet, in one post-order pass
+    Subtrees that are already annotated are not visited again
+    :param root: BiCluster
+    :return: root
+    """
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if node.height is not None:
+            continue
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children(node) if child.height is None)
+            continue
+        if is_leaf(node):
+            node.height = 1
+            node.depth = 0
+        else:
+            branches = children(node)
+            node.height = sum(child.height for child in branches)
+            # the distance of a branch is the max of the 2 branches plus its own distance
+            node.depth = max(child.depth for child in branches) + node.distance
+    return root
+
+
+def height(cluster):
+    """
+    :param cluster: BiCluster
+    :return: number of leaves under cluster, 1 for a leaf
+    """
+    if cluster.height is None:
+        annotate(cluster)
+    return cluster.height
+
+
+def depth(cluster):
+    """
+    :param cluster: BiCluster
+    :return: largest total distance from cluster down to a leaf, 0 for a leaf
+    """
+    if cluster.depth is None:
+        annotate(cluster)
+    return cluster.depth
@@ -0,0 +1,134 @@
+import hashlib
+import httplib
+import json
+import os
+import socket
+import time
+import urllib2
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+"""
+Concurrent RSS fetcher for generate_feed_vector
+Feeds are downloaded by a pool of threads, so one slow feed only holds up its own thread. Only a bounded
+window of feeds is in flight or waiting to be consumed at a time, so memory does not grow with the feed list.
+Raw feed bodies are cached on disk together with their ETag and Last-Modified headers, so the next run sends a
+conditional GET and a feed that did not change costs a 304 instead of a full download
+"""
+
+
+class FeedCache(object):
+    def __init__(self, directory='feed_cache'):
+        """
+        :param directory: folder for the cached bodies, created when missing
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def load(self, url):
+        """
+        :param url: feed url
+        :return: tuple of metadata dictionary and body, (None, None) if url is not cached
+        """
+        path = self._path(url)
+        try:
+            with open(path + '.json') as f:
+                metadata = json.load(f)
+            with open(path + '.xml', 'rb') as f:
+                return metadata, f.read()
+        except (IOError, ValueError):
+            return None, None
+
+    def save(self, url, metadata, body):
+        path = self._path(url)
+        # body first, so metadata never points to a missing body
+        with open(path + '.xml', 'wb') as f:
+            f.write(body)
+        with open(path + '.json', 'w') as f:
+            json.dump(metadata, f)
+
+
+def fetch_feed(url, cache=None, timeout=10, retries=3, backoff=0.5, opener=None):
+    """
+    Download one feed, with conditional GET when it is cached
+    :param url: feed url
+    :param cache: optional FeedCache
+    :param timeout: seconds to wait on the connection before giving up on an attempt
+    :param retries: attempts after the first one, for network errors, timeouts, broken responses and 5xx/429
+        responses
+    :param backoff: seconds before the first retry, doubled on every retry
+    :param opener: urllib2 opener, default is urllib2.build_opener()
+    :return: feed body, or None if every attempt failed or url is not a valid url
+    """
+    if opener is None:
+        opener = urllib2.build_opener()
+    metadata, cached_body = cache.load(url) if cache is not None else (None, None)
+
+    for attempt in range(retries + 1):
+        request = urllib2.Request(url)
+        if metadata is not None:
+            if metadata.get('etag'):
+                request.add_header('If-None-Match', metadata['etag'])
+            if metadata.get('last_modified'):
+                request.add_header('If-Modified-Since', metadata['last_modified'])
+        try:
+            response = opener.open(request, timeout=timeout)
+            body = response.read()
+            if cache is not None:
+                cache.save(url, {'etag': response.info().getheader('ETag'),
+                                 'last_modified': response.info().getheader('Last-Modified')}, body)
+            return body
+        except urllib2.HTTPError as e:
+            if e.code == 304 and cached_body is not None:
+                return cached_body
+            # other client errors will not go away by asking again
+            if 400 <= e.code < 500 and e.code != 429:
+                return cached_body
+        except (urllib2.URLError, httplib.HTTPException, socket.timeout, socket.error):
+            # includes servers that close the connection without an answer (BadStatusLine)
+            pass
+        except ValueError:
+            # malformed url, e.g. a line of the feed list without a scheme
+            return cached_body
+        if attempt < retries:
+            time.sleep(backoff * pow(2, attempt))
+    # serve the stale copy rather than nothing
+    return cached_body
+
+
+def fetch_feeds(urls, cache_dir='feed_cache', concurrency=16, timeout=10, retries=3, backoff=0.5, opener=None,
+                window=None):
+    """
+    Download many feeds concurrently
+    :param urls: iterable of feed urls, read as the downloads go
+    :param cache_dir: folder of the FeedCache, None disables caching
+    :param concurrency: number of feeds downloaded at the same time
+    :param timeout: see fetch_feed
+    :param retries: see fetch_feed
+    :param backoff: see fetch_feed
+    :param opener: see fetch_feed
+    :param window: largest number of feeds submitted but not consumed yet, default is 2 * concurrency. At most
+        this many bodies are held in memory
+    :return: generator of (url, body or None) in the order of urls
+    """
+    cache = FeedCache(cache_dir) if cache_dir is not None else None
+    window = window or 2 * concurrency
+    pool = ThreadPool(concurrency)
+    pending = deque()
+    try:
+        for url in urls:
+            pending.append((url, pool.apply_async(fetch_feed, (url, cache, timeout, retries, backoff, opener))))
+            if len(pending) >= window:
+                url, result = pending.popleft()
+                yield url, result.get()
+        while pending:
+            url, result = pending.popleft()
+            yield url, result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,5 +1,13 @@
 import feedparser
+import os
 import re
+import zlib
+from array import array
+from collections import Counter
+from itertools import imap
+from random import Random
+
+from feed_fetcher import fetch_feeds
 
 """
 Lets create a word count file from blog RSS feeds
@@ -7,33 +15,131 @@ We can use it afterwards to do some clustering experiments
 """
 
 
-def get_word_counts(url):
+# html tags
+TAG = re.compile(r'<[^>]+>')
+
+# split words by all non-alpha characters
+WORD_SEPARATOR = re.compile(r'[^A-Z^a-z]+')
+
+# first line of a sparse word count file
+SPARSE_MAGIC = '#sparse'
+
+
+def get_word_counts(url, body=None, stopwords=None, stem=None):
     """
     Returns title and dictionary of word counts for an RSS Feed
+    Entries go through the tokenize pipeline one by one and their words are counted in bulk by a Counter
     :param url: Url to parse feed
+    :param body: optional feed already downloaded from url, see feed_fetcher
+    :param stopwords: optional set of lowercase words to leave out
+    :param stem: optional function mapping a lowercase word to its stem
     :return: Returns title and dictionary of word counts for an RSS Feed
     """
     # parse the feed
-    d = feedparser.parse(url)
+    d = feedparser.parse(body if body is not None else url)
+    if 'title' not in d.feed:
+        return None, {}  # url, wc
 
-    wc = {}
+    wc = Counter()
+    for chunks in iter_entry_texts(d):
+        wc.update(tokenize(chunks, stopwords, stem))
+    return d.feed.title, wc
 
-    # Loop over all entries
+
+def iter_entry_texts(d):
+    """
+    Text of every entry of a parsed feed
+    :param d: result of feedparser.parse
+    :return: generator with one tuple of html chunks (title, separator, summary) per entry
+    """
     for e in d.entries:
         if 'summary' in e:
             summary = e.summary
         else:
             summary = e.description
+        yield e.title, ' ', summary
+
+
+def strip_tags(chunks):
+    """
+    Remove html tags from a stream of chunks, a tag may start in one chunk and end in a later one.
+    Same rule as TAG: '<>' and a tag that is never closed stay in the text
+    :param chunks: iterable of html strings
+    :return: generator of text strings
+    """
+    # text of a tag that is not closed yet, starting with its '<'
+    pending = ''
+    for chunk in chunks:
+        position = 0
+        while position < len(chunk):
+            if pending:
+                close = chunk.find('>', position)
+                if close < 0:
+                    pending += chunk[position:]
+                    break
+                pending += chunk[position:close]
+                if len(pending) == 1:
+                    # '<>' is not a tag, the '<' is text and the '>' is looked at again
+                    yield pending
+                    position = close
+                else:
+                    position = close + 1
+                pending = ''
+            else:
+                opening = chunk.find('<', position)
+                if opening < 0:
+                    yield chunk[position:] if position else chunk
+                    break
+                if opening > position:
+                    yield chunk[position:opening]
+                pending = '<'
+                position = opening + 1
+    if pending:
+        yield pending
 
-        # Extract a list of words
-        words = get_words(e.title + ' ' + summary)
+
+def iter_words(chunks):
+    """
+    Split html into lowercase words
+    A string, list or tuple of chunks is joined and stripped by TAG in one pass. Any other iterable is read as a
+    stream, where a tag or a word may continue from one chunk into the next
+    :param chunks: html string or iterable of html strings
+    :return: iterator of words in lowercase
+    """
+    if isinstance(chunks, (list, tuple)):
+        chunks = ''.join(chunks)
+    if isinstance(chunks, basestring):
+        return iter([word.lower() for word in WORD_SEPARATOR.split(TAG.sub('', chunks)) if word])
+    return _iter_stream_words(chunks)
+
+
+def _iter_stream_words(chunks):
+    # the last piece of a chunk may be the beginning of a word
+    tail = ''
+    for text in strip_tags(chunks):
+        words = WORD_SEPARATOR.split(tail + text)
+        tail = words.pop()
         for word in words:
-            wc.setdefault(word, 0)
-            wc[word] += 1
-    if 'title' in d.feed:
-        return d.feed.title, wc
-    else:
-        return None, {}  # url, wc
+            if word:
+                yield word.lower()
+    if tail:
+        yield tail.lower()
+
+
+def tokenize(chunks, stopwords=None, stem=None):
+    """
+    Tokenization pipeline: strip tags, split words, drop stopwords, stem
+    :param chunks: html string or iterable of html strings, see iter_words
+    :param stopwords: optional set of lowercase words to leave out
+    :param stem: optional function mapping a lowercase word to its stem
+    :return: iterator of words
+    """
+    words = iter_words(chunks)
+    if stopwords:
+        words = (word for word in words if word not in stopwords)
+    if stem is not None:
+        words = imap(stem, words)
+    return words
 
 
 def get_words(blog):
@@ -42,14 +148,7 @@ def get_words(blog):
     :param blog: an html string
     :return: all words in lowercase
     """
-    # remove all the html tags
-    txt = re.compile(r'<[^>]+>').sub('', blog)
-
-    # split words by all non-alpha characters
-    words = re.compile(r'[^A-Z^a-z]+').split(txt)
-
-    # convert to lowercase
-    return [word.lower() for word in words if word != '']
+    return list(iter_words(blog))
 
 
 def filter_word_list(blog_word_count, length_of_feed_list):
@@ -70,20 +169,27 @@ def filter_word_list(blog_word_count, length_of_feed_list):
     return word_list
 
 
-def save_word_list(word_list, word_counts):
+def _iter_blogs(word_counts):
+    if isinstance(word_counts, dict):
+        return word_counts.iteritems()
+    return word_counts
+
+
+def save_word_list(word_list, word_counts, filename='blogdata.txt'):
     """
     Save in text file a big matrix of all the words count for each blog
     tab delimeted
     :param word_list:
-    :param word_counts:
+    :param word_counts: dictionary of blog -> dictionary of word counts, or an iterable of (blog, word counts)
+    :param filename:
     :return:
     """
-    out = file('blogdata.txt', 'w')
+    out = file(filename, 'w')
     out.write('Blog')
     for word in word_list:
         out.write('\t%s' % word)
     out.write('\n')
-    for blog, wc in word_counts.items():
+    for blog, wc in _iter_blogs(word_counts):
         if blog is not None and len(blog) > 0:
             # deal with unicode outside ascii range
             blog = blog.encode('ascii', 'ignore')
@@ -97,18 +203,188 @@ def save_word_list(word_list, word_counts):
             out.write('\n')
 
 
-def generate():
+def save_sparse_word_list(word_list, word_counts, filename='blogdata.txt'):
+    """
+    Save the word counts of each blog in sparse format. Only the counts that are not 0 are written
+    clusters.read_file reads both this format and the dense one of save_word_list, so both go to blogdata.txt by
+    default and the clustering scripts pick up whichever was written last
+    Format, tab delimited:
+        #sparse
+        Blog    word_0  word_1  ...
+        blog name   column:count    column:count    ...
+    :param word_list: the columns
+    :param word_counts: dictionary of blog -> dictionary of word counts, or an iterable of (blog, word counts)
+    :param filename:
+    :return: None
+    """
+    column_index = dict((word, i) for i, word in enumerate(word_list))
+    with open(filename, 'w') as out:
+        out.write(SPARSE_MAGIC + '\n')
+        out.write('\t'.join(['Blog'] + word_list) + '\n')
+        for blog, wc in _iter_blogs(word_counts):
+            if blog is not None and len(blog) > 0:
+                # deal with unicode outside ascii range
+                blog = blog.encode('ascii', 'ignore')
+                cells = sorted((column_index[word], count) for word, count in wc.items()
+                               if word in column_index and count != 0)
+                out.write(blog)
+                for column, count in cells:
+                    out.write('\t%d:%d' % (column, count))
+                out.write('\n')
+
+
+# Mersenne prime 2^61 - 1 for the hash functions of CountMinSketch
+PRIME = (1 << 61) - 1
+
+
+class CountMinSketch(object):
+    def __init__(self, width=1 << 20, depth=4, seed=0):
+        """
+        Approximate counter with fixed memory, depth rows of width counters.
+        An estimate is never lower than the true count and only higher when words collide in every row
+        :param width: counters per row
+        :param depth: number of rows, each with its own hash function
+        :param seed: seed of the random hash functions
+        """
+        self.width = width
+        self.depth = depth
+        self.rows = [array('l', [0]) * width for i in range(depth)]
+        # one universal hash (a * h + b) % p per row. Seeding crc32 differently per row is no use, crc is affine
+        # in its seed and 2 words of the same length that collide in one row would collide in every row
+        rng = Random(seed)
+        self.hash_functions = [(rng.randint(1, PRIME - 1), rng.randint(0, PRIME - 1)) for i in range(depth)]
+
+    def _slots(self, word):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        # 64 bits from 2 unrelated checksums, so whole word hashes almost never collide
+        h = ((zlib.adler32(word) & 0xffffffff) << 32 | (zlib.crc32(word) & 0xffffffff)) % PRIME
+        return [(a * h + b) % PRIME % self.width for a, b in self.hash_functions]
+
+    def add(self, word, count=1):
+        for row, slot in zip(self.rows, self._slots(word)):
+            row[slot] += count
+
+    def __getitem__(self, word):
+        return min(row[slot] for row, slot in zip(self.rows, self._slots(word)))
+
+
+def unique_titles(feeds):
+    """
+    Leave out the feeds without a title and the feeds whose title came earlier, the title is the row name of
+    the blog. Both modes of generate keep the first feed of each title this way
+    :param feeds: iterable of (title, word counts) pairs
+    :return: generator of (title, word counts)
+    """
+    seen = set()
+    for title, wc in feeds:
+        if title is None or len(title) == 0 or title in seen:
+            continue
+        seen.add(title)
+        yield title, wc
+
+
+def write_spill(out, title, wc):
     """
-    Main function to generate the txt file with word counts
+    Append the word counts of one feed to a spill file, one line per feed: title, then word:count cells
+    """
+    # titles must stay on one line and in one cell
+    title = title.encode('ascii', 'ignore').replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+    out.write(title)
+    for word, count in wc.items():
+        out.write('\t%s:%d' % (word, count))
+    out.write('\n')
+
+
+def iter_spill(filename):
+    """
+    Read back a spill file one feed at a time
+    :return: generator of (title, {word: count})
+    """
+    with open(filename) as f:
+        for line in f:
+            p = line.rstrip('\n').split('\t')
+            wc = {}
+            for cell in p[1:]:
+                word, count = cell.split(':')
+                wc[word] = int(count)
+            yield p[0], wc
+
+
+def generate_streaming(feeds, length_of_feed_list, spill_file='wordcounts.spill', sketch_width=None,
+                       sketch_depth=4):
+    """
+    Two pass version of generate that never holds the word counts of every feed in memory
+    Pass 1 writes the counts of each feed to spill_file as it arrives and only accumulates document frequencies,
+    in a dictionary or, when sketch_width is given, in a CountMinSketch of fixed size.
+    Pass 2 reads the spill back to pick the word list and then once more to write the matrix.
+    The sketch can only overestimate, so a rare word may pass the lower limit of filter_word_list
+    :param feeds: iterable of (title, word counts) pairs, one per feed. Only the first feed of each title is kept,
+        see unique_titles
+    :param length_of_feed_list: number of feeds, for the document frequency fractions
+    :param spill_file: path of the temporary file with per feed counts
+    :param sketch_width: counters per row of the sketch, None keeps exact frequencies in a dictionary
+    :param sketch_depth: rows of the sketch
+    :return: tuple of word list and a generator of (blog, word counts) read from the spill
+    """
+    blog_count = CountMinSketch(sketch_width, sketch_depth) if sketch_width else {}
+    with open(spill_file, 'w') as out:
+        for title, wc in unique_titles(feeds):
+            for word, count in wc.items():
+                if count > 1:
+                    if sketch_width:
+                        blog_count.add(word)
+                    else:
+                        blog_count[word] = blog_count.get(word, 0) + 1
+            write_spill(out, title, wc)
+
+    if sketch_width:
+        # only the words that make it into the list are kept
+        word_set = set()
+        for title, wc in iter_spill(spill_file):
+            candidates = dict((word, blog_count[word]) for word in wc if word not in word_set)
+            word_set.update(filter_word_list(candidates, length_of_feed_list))
+        word_list = sorted(word_set)
+    else:
+        word_list = filter_word_list(blog_count, length_of_feed_list)
+    return word_list, iter_spill(spill_file)
+
+
+def generate(concurrency=16, timeout=10, retries=3, cache_dir='feed_cache', sparse=True, streaming=False,
+             spill_file='wordcounts.spill', sketch_width=None):
+    """
+    Main function to generate the file with word counts
+    Feeds are downloaded concurrently by feed_fetcher and cached in cache_dir between runs
+    :param concurrency: number of feeds downloaded at the same time
+    :param timeout: seconds to wait on a feed before retrying it
+    :param retries: attempts after the first one for a failing feed
+    :param cache_dir: folder for cached feeds, None disables the cache
+    :param sparse: write blogdata.txt in the sparse format of save_sparse_word_list, or the dense one when False
+    :param streaming: spill word counts to disk instead of keeping them in memory, see generate_streaming
+    :param spill_file: path of the spill file in streaming mode
+    :param sketch_width: in streaming mode, bound the document frequency table with a CountMinSketch this wide
     :return: None
     """
     blog_count = {}
-    feed_list = []
+    feed_list = [feed_url.strip() for feed_url in file('feedlist.txt')]
     word_counts = {}
+    downloads = fetch_feeds(feed_list, cache_dir, concurrency, timeout, retries)
+    # a feed that could not be downloaded has no title, like an unparseable one
+    feeds = (get_word_counts(feed_url, body) if body is not None else (None, {}) for feed_url, body in downloads)
+
+    if streaming:
+        try:
+            word_list, word_counts = generate_streaming(feeds, len(feed_list), spill_file, sketch_width)
+            if sparse:
+                save_sparse_word_list(word_list, word_counts)
+            else:
+                save_word_list(word_list, word_counts)
+        finally:
+            if os.path.exists(spill_file):
+                os.remove(spill_file)
+        return
 
-    for feed_url in file('feedlist.txt'):
-        feed_list.append(feed_url)
-        title, wc = get_word_counts(feed_url)
+    for title, wc in unique_titles(feeds):
         word_counts[title] = wc
         for word, count in wc.items():
             blog_count.setdefault(word, 0)
@@ -117,7 +393,10 @@ def generate():
 
     # get word list
     word_list = filter_word_list(blog_count, len(feed_list))
-    save_word_list(word_list, word_counts)
+    if sparse:
+        save_sparse_word_list(word_list, word_counts)
+    else:
+        save_word_list(word_list, word_counts)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+import BaseHTTPServer
+import shutil
+import tempfile
+import threading
+import unittest
+
+from feed_fetcher import FeedCache, fetch_feed, fetch_feeds
+
+"""
+Offline tests of feed_fetcher against a local HTTP server
+    python -m unittest test_feed_fetcher
+"""
+
+FEED = '<rss><channel><title>Local</title></channel></rss>'
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # path -> list of responses still to give, the last one repeats
+    script = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.getheader('If-None-Match')))
+        responses = self.script.get(self.path, ['404'])
+        action = responses.pop(0) if len(responses) > 1 else responses[0]
+        if action == 'close':
+            # no status line at all, the client sees httplib.BadStatusLine
+            self.close_connection = 1
+            return
+        if action == 'etag':
+            if self.headers.getheader('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            action = '200'
+        code = int(action)
+        self.send_response(code)
+        if code == 200:
+            self.send_header('ETag', '"v1"')
+        self.end_headers()
+        if code == 200:
+            self.wfile.write(FEED + self.path)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedFetcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.base = 'http://127.0.0.1:%d' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _Handler.script = {}
+        del _Handler.requests[:]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, path, cache=None, retries=2):
+        return fetch_feed(self.base + path, cache, timeout=5, retries=retries, backoff=0)
+
+    def test_download(self):
+        _Handler.script['/a'] = ['200']
+        self.assertEqual(self.fetch('/a'), FEED + '/a')
+
+    def test_retries_server_errors(self):
+        _Handler.script['/a'] = ['503', '429', '200']
+        self.assertEqual(self.fetch('/a'), FEED + '/a')
+        self.assertEqual(len(_Handler.requests), 3)
+
+    def test_client_error_is_not_retried(self):
+        _Handler.script['/a'] = ['404']
+        self.assertIsNone(self.fetch('/a'))
+        self.assertEqual(len(_Handler.requests), 1)
+
+    def test_retries_closed_connection(self):
+        _Handler.script['/a'] = ['close', '200']
+        self.assertEqual(self.fetch('/a'), FEED + '/a')
+        _Handler.script['/b'] = ['close']
+        self.assertIsNone(self.fetch('/b', retries=1))
+
+    def test_malformed_url(self):
+        self.assertIsNone(fetch_feed('not a url', retries=2, backoff=0))
+
+    def test_conditional_get(self):
+        cache = FeedCache(self.directory)
+        _Handler.script['/a'] = ['etag']
+        self.assertEqual(self.fetch('/a', cache), FEED + '/a')
+        self.assertEqual(self.fetch('/a', cache), FEED + '/a')
+        self.assertEqual(_Handler.requests, [('/a', None), ('/a', '"v1"')])
+
+    def test_stale_copy_when_server_fails(self):
+        cache = FeedCache(self.directory)
+        _Handler.script['/a'] = ['200', '500']
+        self.assertEqual(self.fetch('/a', cache), FEED + '/a')
+        self.assertEqual(self.fetch('/a', cache, retries=1), FEED + '/a')
+
+    def test_fetch_feeds_keeps_order_and_survives_failures(self):
+        for i in range(20):
+            _Handler.script['/%d' % i] = ['close'] if i % 5 == 0 else ['200']
+        urls = [self.base + '/%d' % i for i in range(20)] + ['ftp//bad']
+        results = list(fetch_feeds(urls, cache_dir=None, concurrency=4, timeout=5, retries=0, backoff=0))
+        self.assertEqual([url for url, body in results], urls)
+        for i, (url, body) in enumerate(results[:20]):
+            self.assertEqual(body, None if i % 5 == 0 else FEED + '/%d' % i)
+        self.assertIsNone(results[20][1])
+
+    def test_fetch_feeds_window(self):
+        _Handler.script['/a'] = ['200']
+        submitted = []
+
+        def urls():
+            for i in range(50):
+                submitted.append(i)
+                yield self.base + '/a'
+
+        consumed = 0
+        for url, body in fetch_feeds(urls(), cache_dir=None, concurrency=2, timeout=5, retries=0, window=3):
+            consumed += 1
+            # urls are only read ahead of the consumer by the window
+            self.assertLessEqual(len(submitted) - consumed, 3)
+        self.assertEqual(consumed, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+from synthetic_data import power_law_preferences, sparse_word_counts, dense_rows
+
+"""
+Benchmarks of the recommender and clustering entry points on synthetic data
+Every (case, size) runs in a fresh interpreter, so its peak memory is its own and not what earlier cases left
+behind. Results go to a JSON file that a later run can be compared with:
+
+    python run_benchmarks.py --output before.json
+    ... change the code ...
+    python run_benchmarks.py --output after.json --compare before.json
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'Making Recommendations', 'Collaborative Filtering'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Unsupervised Learning', 'Word Vectors', 'Clustering'))
+
+WORDS = 500
+
+
+def _preferences(size, seed):
+    # size is the number of users, there are 4 users per item like in a typical catalogue
+    return power_law_preferences(size, max(50, size // 4), density=0.02, seed=seed)
+
+
+def _rows(size, seed):
+    # size is the number of blogs
+    names, words, rows = sparse_word_counts(size, WORDS, density=0.05, seed=seed)
+    return dense_rows(rows, WORDS)
+
+
+def get_recommendations_case(size, seed):
+    from recommendations import get_recommendations
+    preferences = _preferences(size, seed)
+    people = sorted(preferences)[:20]
+    return lambda: [get_recommendations(preferences, person) for person in people], len(people), 'users'
+
+
+def get_recommendations_batch_case(size, seed):
+    from recommendations import get_recommendations_batch
+    preferences = _preferences(size, seed)
+    # results are streamed, consume them one by one like a job writing them out would
+    return lambda: sum(1 for result in get_recommendations_batch(preferences)), len(preferences), 'users'
+
+
+def calculate_similar_items_case(size, seed):
+    from recommendations import calculate_similar_items
+    preferences = _preferences(size, seed)
+    items = len(set(item for ratings in preferences.values() for item in ratings))
+    return lambda: calculate_similar_items(preferences), items, 'items'
+
+
+def hierarchical_cluster_case(size, seed):
+    from hierarchical_clustering import hierarchical_cluster
+    rows = _rows(size, seed)
+    return lambda: hierarchical_cluster(rows), size, 'rows'
+
+
+def linkage_cluster_case(size, seed):
+    from linkage_clustering import linkage_cluster
+    rows = _rows(size, seed)
+    return lambda: linkage_cluster(rows, linkage='centroid'), size, 'rows'
+
+
+def k_means_clustering_case(size, seed):
+    import random
+    from k_means_clustering import k_means_clustering
+    rows = _rows(size, seed)
+    random.seed(seed)
+    return lambda: k_means_clustering(rows, k=10), size, 'rows'
+
+
+def fast_k_means_case(size, seed):
+    from fast_k_means import fast_k_means
+    rows = _rows(size, seed)
+    return lambda: fast_k_means(rows, k=10, seed=seed), size, 'rows'
+
+
+def scale_down_case(size, seed):
+    from multidimensional_scaling import scale_down
+    rows = _rows(size, seed)
+    return lambda: scale_down(rows, seed=seed), size, 'rows'
+
+
+# case name -> (setup function, default sizes)
+# setup(size, seed) builds the data and returns (function to time, number of units it processes, unit name)
+CASES = OrderedDict([
+    ('get_recommendations', (get_recommendations_case, [100, 1000, 5000])),
+    ('get_recommendations_batch', (get_recommendations_batch_case, [100, 1000, 5000])),
+    ('calculate_similar_items', (calculate_similar_items_case, [100, 1000, 5000])),
+    ('hierarchical_cluster', (hierarchical_cluster_case, [25, 50, 100])),
+    ('linkage_cluster', (linkage_cluster_case, [100, 250, 500])),
+    ('k_means_clustering', (k_means_clustering_case, [100, 250, 500])),
+    ('fast_k_means', (fast_k_means_case, [100, 250, 500])),
+    ('scale_down', (scale_down_case, [50, 100, 200]))
+])
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_case(name, size, seed, repeat):
+    """
+    Time one case, in the current process
+    :return: dictionary of results, seconds is the fastest of repeat runs
+    """
+    setup = CASES[name][0]
+    started = time.time()
+    function, units, unit = setup(size, seed)
+    setup_seconds = time.time() - started
+    data_rss_kb = peak_rss_kb()
+
+    # the algorithms print progress, keep it out of the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        timings = []
+        for r in range(repeat):
+            started = time.time()
+            function()
+            timings.append(time.time() - started)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    seconds = min(timings)
+    return OrderedDict([
+        ('case', name),
+        ('size', size),
+        ('seed', seed),
+        ('units', units),
+        ('unit', unit),
+        ('seconds', seconds),
+        ('throughput', units / seconds if seconds > 0 else None),
+        ('timings', timings),
+        ('setup_seconds', setup_seconds),
+        ('data_rss_kb', data_rss_kb),
+        ('peak_rss_kb', peak_rss_kb())
+    ])
+
+
+def run_in_subprocess(name, size, seed, repeat):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', name, str(size), '--seed', str(seed),
+               '--repeat', str(repeat)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        return OrderedDict([('case', name), ('size', size), ('seed', seed), ('error', err.strip().splitlines()[-1:])])
+    return json.loads(out, object_pairs_hook=OrderedDict)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the ratio of every (case, size) to the same entry of baseline
+    :param results: results dictionary of this run
+    :param baseline: results dictionary of an earlier run
+    :param threshold: a ratio of time or of peak memory above it is a regression
+    :return: list of (case, size, what, ratio) regressions
+    """
+    before = dict(((r['case'], r['size']), r) for r in baseline['results'] if 'error' not in r)
+    regressions = []
+    print '{:<28}{:>8}{:>12}{:>12}'.format('case', 'size', 'time', 'memory')
+    for r in results['results']:
+        old = before.get((r['case'], r['size']))
+        if old is None or 'error' in r:
+            continue
+        time_ratio = r['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        memory_ratio = float(r['peak_rss_kb']) / old['peak_rss_kb'] if old['peak_rss_kb'] > 0 else float('inf')
+        flags = []
+        if time_ratio > threshold:
+            regressions.append((r['case'], r['size'], 'time', time_ratio))
+            flags.append('TIME')
+        if memory_ratio > threshold:
+            regressions.append((r['case'], r['size'], 'memory', memory_ratio))
+            flags.append('MEMORY')
+        print '{:<28}{:>8}{:>11.2f}x{:>11.2f}x  {}'.format(r['case'], r['size'], time_ratio, memory_ratio,
+                                                         ' '.join(flags))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark recommender and clustering entry points')
+    parser.add_argument('--cases', help='comma separated case names, default is all: ' + ', '.join(CASES))
+    parser.add_argument('--sizes', help='comma separated sizes for every selected case, default is per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the fastest one is reported')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='results file of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='ratio that counts as a regression')
+    parser.add_argument('--worker', nargs=2, metavar=('CASE', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print json.dumps(run_case(args.worker[0], int(args.worker[1]), args.seed, args.repeat))
+        return 0
+
+    names = args.cases.split(',') if args.cases else list(CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error('unknown case {}'.format(name))
+    sizes = [int(size) for size in args.sizes.split(',')] if args.sizes else None
+
+    results = OrderedDict([
+        ('meta', OrderedDict([
+            ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('commit', _git_commit()),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('seed', args.seed),
+            ('repeat', args.repeat)
+        ])),
+        ('results', [])
+    ])
+    for name in names:
+        for size in sizes or CASES[name][1]:
+            result = run_in_subprocess(name, size, args.seed, args.repeat)
+            results['results'].append(result)
+            if 'error' in result:
+                print '{:<28}{:>8}  failed: {}'.format(name, size, ' '.join(result['error']))
+            else:
+                print '{:<28}{:>8}{:>10.3f}s{:>12.1f} {}/s{:>10} KB'.format(
+                    name, size, result['seconds'], result['throughput'] or 0, result['unit'], result['peak_rss_kb'])
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
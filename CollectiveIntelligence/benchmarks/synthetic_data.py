@@ -0,0 +1,126 @@
+from bisect import bisect_left
+from random import Random
+
+"""
+Seeded synthetic workloads for the benchmarks
+Real rating and word count data are long tailed: a few items get most ratings and a few words most occurrences.
+Both generators draw from Zipf weights, so the shape of the data matches production data at any size.
+The same arguments and seed always give the same data
+"""
+
+
+def zipf_weights(n, alpha=1.0):
+    """
+    :param n: number of ranks
+    :param alpha: skew, 0 gives uniform weights
+    :return: list of weights 1 / rank ** alpha
+    """
+    return [1.0 / pow(rank, alpha) for rank in range(1, n + 1)]
+
+
+class WeightedSampler(object):
+    def __init__(self, weights, rng):
+        """
+        Draw indices with probability proportional to weights, by binary search on the cumulative weights
+        :param weights: list of non negative weights
+        :param rng: random.Random instance
+        """
+        self.cumulative = []
+        total = 0.0
+        for w in weights:
+            total += w
+            self.cumulative.append(total)
+        self.total = total
+        self.rng = rng
+
+    def draw(self):
+        return bisect_left(self.cumulative, self.rng.random() * self.total)
+
+    def sample(self, k):
+        """
+        :return: set of k distinct indices, k is capped to the number of weights
+        """
+        k = min(k, len(self.cumulative))
+        chosen = set()
+        while len(chosen) < k:
+            chosen.add(self.draw())
+        return chosen
+
+
+def power_law_preferences(users, items, density=0.02, alpha=1.0, activity_alpha=0.5, seed=0):
+    """
+    Rating matrix in the format of data_storage.critics
+    Item popularity and user activity both follow Zipf laws. A rating is the quality of the item plus the bias of
+    the user plus noise, rounded to half stars between 1 and 5
+    :param users: number of users
+    :param items: number of items
+    :param density: fraction of the users x items cells that hold a rating
+    :param alpha: skew of item popularity
+    :param activity_alpha: skew of user activity
+    :param seed: random seed
+    :return: dictionary of user -> {item: rating}, every user has at least one rating
+    """
+    rng = Random(seed)
+    item_names = ['item%d' % i for i in range(items)]
+    quality = [rng.gauss(3.0, 0.7) for i in range(items)]
+    popularity = WeightedSampler(zipf_weights(items, alpha), rng)
+
+    # ratings per user proportional to a Zipf activity, users are shuffled so activity is not tied to the name
+    activity = zipf_weights(users, activity_alpha)
+    rng.shuffle(activity)
+    total_ratings = density * users * items
+    scale = total_ratings / sum(activity)
+
+    preferences = {}
+    for u in range(users):
+        bias = rng.gauss(0.0, 0.5)
+        count = max(1, int(round(activity[u] * scale)))
+        ratings = {}
+        for i in popularity.sample(count):
+            rating = quality[i] + bias + rng.gauss(0.0, 0.8)
+            ratings[item_names[i]] = min(5.0, max(1.0, round(rating * 2) / 2.0))
+        preferences['user%d' % u] = ratings
+    return preferences
+
+
+def sparse_word_counts(blogs, words, density=0.05, alpha=1.0, seed=0):
+    """
+    Word count matrix like the rows of clusters.iter_sparse_rows
+    Word frequencies follow a Zipf law, every blog uses a Zipf sample of the vocabulary with counts that are
+    larger for more frequent words
+    :param blogs: number of rows
+    :param words: number of columns
+    :param density: average fraction of the vocabulary used by a blog
+    :param alpha: skew of word frequencies
+    :param seed: random seed
+    :return: tuple of blog names, word names and list of {column index: count}
+    """
+    rng = Random(seed)
+    weights = zipf_weights(words, alpha)
+    frequency = WeightedSampler(weights, rng)
+    top = weights[0]
+    per_blog = max(1, int(density * words))
+
+    rows = []
+    for b in range(blogs):
+        distinct = max(1, int(rng.expovariate(1.0 / per_blog)))
+        row = {}
+        for column in frequency.sample(distinct):
+            row[column] = 1 + int(rng.expovariate(1.0) * 10 * weights[column] / top)
+        rows.append(row)
+    return ['blog%d' % b for b in range(blogs)], ['word%d' % w for w in range(words)], rows
+
+
+def dense_rows(sparse_rows, columns):
+    """
+    :param sparse_rows: list of {column index: count}
+    :param columns: number of columns
+    :return: list of lists of floats, the rows of clusters.read_file
+    """
+    result = []
+    for row in sparse_rows:
+        dense = [0.0] * columns
+        for column, count in row.items():
+            dense[column] = float(count)
+        result.append(dense)
+    return result